@@ -6,9 +6,13 @@ from __future__ import absolute_import
 import logging
 import click
 import sys
+import os
 
 import importlib
 from asrclient import client
+from asrclient import dispatch
+from asrclient import encoder
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import pyaudio
@@ -83,9 +87,55 @@ except ImportError:
 @click.option('--callback-module',
               help='Python module name which should implement advanced_callback(AddDataResponse).\nIt takes corresponding protobuf message as a parameter. See advanced_callback_example.py for details.',
               default=None)
+@click.option('--mmap',
+              is_flag=True,
+              help='Memory map input files instead of reading them chunk by chunk, wav headers are not sent. Works with regular files only.')
+@click.option('--batch',
+              is_flag=True,
+              help='Recognize every file (or every file in a directory) in a session of its own and write a transcript per file.')
+@click.option('--jobs',
+              default=client.DEFAULT_CONCURRENCY,
+              type=int,
+              help='Batch mode: how many files are recognized in parallel. Default is {0}.'.format(client.DEFAULT_CONCURRENCY))
+@click.option('--output-dir',
+              default=None,
+              type=click.Path(file_okay=False),
+              help='Batch mode: directory for transcripts. Default is to write <file>.txt next to each input file.')
+@click.option('--resume',
+              is_flag=True,
+              help='Batch mode: skip files which already have a transcript.')
 @click.argument('files',
                 nargs=-1,
-                type=click.File('rb'))
+                type=click.Path(exists=True, allow_dash=True))
+@click.option('--partial-results/--no-partial-results',
+              default=True,
+              help='Get partial results while an utterance is being recognized or only the final ones. Default is to get them.')
+@click.option('--allow-multi-utt/--no-multi-utt',
+              default=True,
+              help='Split audio into utterances or get a single result after the last chunk. Default is to split.')
+@click.option('--chunk-process-limit',
+              default=client.DEFAULT_CHUNK_PROCESS_LIMIT,
+              help='How many chunks the server may take at once when it lags behind, affects how often partial results come. Default is {0}.'.format(client.DEFAULT_CHUNK_PROCESS_LIMIT))
+@click.option('--partial-interval',
+              default=0,
+              help='Handle at most one partial result per that many milliseconds, the newest of the rest is handled when the interval is over. Default is 0, handle all of them.')
+@click.option('--callback-workers',
+              default=0,
+              help='Run callbacks in that many threads, so slow ones don\'t hold up reading responses. Default is 0, run them in the reading thread.')
+@click.option('--callback-queue',
+              default=dispatch.DEFAULT_QUEUE_SIZE,
+              help='How many callback calls may wait for --callback-workers. Default is {0}.'.format(dispatch.DEFAULT_QUEUE_SIZE))
+@click.option('--callback-policy',
+              type=click.Choice(dispatch.POLICIES),
+              default=dispatch.BLOCK,
+              help='What to do when the callback queue is full: wait, drop partial results or keep only the latest partial result. Default is {0}.'.format(dispatch.BLOCK))
+@click.option('--compress',
+              type=click.Choice(sorted(encoder.ENCODERS)),
+              default=None,
+              help='Compress pcm or wav input before sending it, opus needs the opuslib module. Default is to send it as is.')
+@click.option('--encoder-threads',
+              default=0,
+              help='Compress audio in that many threads shared by all the sessions, ahead of sending it. Default is 0, compress it in the sending thread.')
 @click.option('--capitalize',
               is_flag=True,
               help='Should each utterance start with a capital letter?')
@@ -107,16 +157,27 @@ except ImportError:
 @click.option('--grammar-file',
               default="",
               help='Custom grammar, can be list of lines or xml file description')
-def main(chunk_size, start_with_chunk, max_chunks_count, record, files, silent, **kwars):
+def main(chunk_size, start_with_chunk, max_chunks_count, record, files, silent, mmap, batch, jobs, output_dir, resume, callback_workers, callback_queue, callback_policy, encoder_threads, **kwars):
     if not silent:
         logging.basicConfig(level=logging.INFO)
 
+    if callback_workers > 0:
+        kwars['dispatcher'] = dispatch.CallbackDispatcher(callback_workers, callback_queue, callback_policy)
+
+    if kwars['compress'] is not None and encoder_threads > 0:
+        kwars['encoder_pool'] = ThreadPoolExecutor(max_workers=encoder_threads)
+
+    read_chunks = client.read_chunks_from_mmap if mmap else client.read_chunks_from_files
+
+    if batch:
+        sys.exit(recognize_batch(files, read_chunks, chunk_size, start_with_chunk, max_chunks_count, jobs, output_dir, resume, **kwars))
+
     chunks = []
     if files:
-        chunks = client.read_chunks_from_files(files,
-                                               chunk_size,
-                                               start_with_chunk,
-                                               max_chunks_count)
+        chunks = read_chunks([click.open_file(path, 'rb') for path in files],
+                             chunk_size,
+                             start_with_chunk,
+                             max_chunks_count)
     else:
         if record:
             if is_pyaudio:
@@ -137,5 +198,88 @@ def main(chunk_size, start_with_chunk, max_chunks_count, record, files, silent,
                          callback=default_callback,
                          **kwars)
 
+
+def list_batch_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if not name.endswith(('.txt', '.txt.part')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def input_root(paths):
+    """Deepest directory holding every input path."""
+    dirs = [os.path.abspath(path if os.path.isdir(path) else os.path.dirname(path)).split(os.sep) for path in paths]
+    return os.sep.join(os.path.commonprefix(dirs)) or os.sep
+
+
+def transcript_path(path, output_dir, root=None):
+    """<path>.txt, or the same path relative to root under output_dir, so inputs with the same name don't collide."""
+    if output_dir is None:
+        return path + '.txt'
+    if root is None:
+        root = input_root([path])
+    return os.path.join(output_dir, os.path.relpath(os.path.abspath(path), root) + '.txt')
+
+
+def recognize_batch(paths, read_chunks, chunk_size, start_with_chunk, max_chunks_count, jobs, output_dir, resume, **kwars):
+    if output_dir is not None and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    root = input_root(paths)
+    files = []
+    for path in list_batch_files(paths):
+        if resume and os.path.exists(transcript_path(path, output_dir, root)):
+            continue
+        files.append(path)
+    if not files:
+        click.echo('Nothing to recognize.')
+        return 0
+
+    def read_file(path):
+        with open(path, 'rb') as f:
+            for chunk in read_chunks([f], chunk_size, start_with_chunk, max_chunks_count):
+                yield chunk
+
+    transcripts = [[] for _ in files]
+
+    def on_utterance(index, utterance, start_time=0.0, end_time=0.0, data=None):
+        transcripts[index].append(utterance)
+
+    def on_done(index, error):
+        if error is not None:
+            click.echo('{0}: failed, {1}'.format(files[index], error), err=True)
+            return
+        # written under a temporary name first, so an interrupted run is resumed from this file
+        result = transcript_path(files[index], output_dir, root)
+        directory = os.path.dirname(result)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another session's callback meanwhile
+                if not os.path.isdir(directory):
+                    raise
+        with open(result + '.part', 'wb') as f:
+            for utterance in transcripts[index]:
+                f.write(utterance + b'\n')
+        os.rename(result + '.part', result)
+        transcripts[index] = None
+        click.echo('{0}: done'.format(files[index]))
+
+    stats = client.recognize_many([read_file(path) for path in files],
+                                  callback=on_utterance,
+                                  concurrency=jobs,
+                                  done_callback=on_done,
+                                  **kwars)
+    click.echo('{0} files ({1} failed) in {2:.2f} seconds, {3:.2f} files/sec, {4:.2f} audio-seconds/sec'.format(
+        stats['sources'], stats['failed'], stats['seconds'], stats['sources_per_second'], stats['audio_seconds_per_second']))
+    return 1 if stats['failed'] else 0
+
+
 if __name__ == "__main__":
         main()
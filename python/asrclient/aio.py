@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""asyncio flavour of the Yandex ASR and TTS streaming libraries (python 3 only).
+
+The whole session lives in the event loop: no executor thread and no sleep
+loops, so a single process can keep thousands of sessions in flight.
+
+    async for response in recognize_async(chunks, key=...):
+        print(response.endOfUtt, [r.normalized for r in response.recognition])
+
+    async for chunk in generate_async(text, 'jane', key=...):
+        play(chunk.audio)
+"""
+
+import asyncio
+import logging
+import socket
+
+from .basic_pb2 import ConnectionResponse
+from .voiceproxy_pb2 import AddDataResponse
+from .client import ServerError, make_connection_request, check_add_data_response, add_data_parts, LAST_CHUNK_MESSAGE, \
+    DEFAULT_FORMAT_VALUE, DEFAULT_SERVER_VALUE, DEFAULT_PORT_VALUE, DEFAULT_KEY_VALUE, DEFAULT_MODEL_VALUE, \
+    DEFAULT_LANG_VALUE, DEFAULT_INTER_UTT_SILENCE, DEFAULT_CMN_LATENCY, DEFAULT_UUID_VALUE, DEFAULT_PENDING_LIMIT, \
+    DEFAULT_CHUNK_PROCESS_LIMIT
+from .transport import TransportError, frameHeader
+from . import ttsclient
+from .tts_pb2 import ConnectionRequest as TtsConnectionRequest, ParamsRequest, ParamsResponse
+from .ttsbackend_pb2 import GenerateResponse
+
+
+class Connection(object):
+    """Hex framed protobuf messages over asyncio streams, the same wire format as Transport."""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host, port, enable_ssl=False, ipv4=False):
+        reader, writer = await asyncio.open_connection(host, port,
+                                                       ssl=True if enable_ssl else None,
+                                                       family=socket.AF_INET if ipv4 else 0)
+        return cls(reader, writer)
+
+    async def upgrade(self, request, check):
+        self.writer.write(request.encode('utf-8'))
+        try:
+            response = await self.reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            raise TransportError('Backend closed connection')
+        except asyncio.LimitOverrunError:
+            return False
+        return response.decode('utf-8', 'replace').startswith(check)
+
+    def send_message(self, message):
+        self.send_message_parts([message])
+
+    def send_message_parts(self, parts):
+        self.writer.writelines([frameHeader(sum(len(part) for part in parts))] + list(parts))
+
+    def send_protobuf(self, protobuf):
+        self.send_message(protobuf.SerializeToString())
+
+    async def drain(self):
+        await self.writer.drain()
+
+    async def recv_message(self):
+        try:
+            size = int(await self.reader.readuntil(b'\r\n'), 16)
+            if size > 0:
+                return await self.reader.readexactly(size)
+            return b''
+        except asyncio.IncompleteReadError:
+            raise TransportError('Backend closed connection')
+
+    async def recv_protobuf(self, *protobufTypes):
+        savedException = None
+
+        message = await self.recv_message()
+        for protoType in protobufTypes:
+            response = protoType()
+            try:
+                response.ParseFromString(message)
+                return response
+            except Exception as exc:
+                savedException = exc
+
+        raise savedException
+
+    def close(self):
+        self.writer.close()
+
+
+async def _iterate(chunks):
+    if hasattr(chunks, '__aiter__'):
+        async for chunk in chunks:
+            yield chunk
+    else:
+        for chunk in chunks:
+            yield chunk
+
+
+async def recognize_async(chunks,
+                          format=DEFAULT_FORMAT_VALUE,
+                          server=DEFAULT_SERVER_VALUE,
+                          port=DEFAULT_PORT_VALUE,
+                          key=DEFAULT_KEY_VALUE,
+                          app='local',
+                          service='dictation',
+                          model=DEFAULT_MODEL_VALUE,
+                          lang=DEFAULT_LANG_VALUE,
+                          inter_utt_silence=DEFAULT_INTER_UTT_SILENCE,
+                          cmn_latency=DEFAULT_CMN_LATENCY,
+                          biometry="",
+                          uuid=DEFAULT_UUID_VALUE,
+                          pending_limit=DEFAULT_PENDING_LIMIT,
+                          ipv4=False,
+                          nopunctuation=False,
+                          capitalize=False,
+                          expected_num_count=0,
+                          snr=False,
+                          snr_flags=None,
+                          grammar_file="",
+                          partial_results=True,
+                          allow_multi_utt=True,
+                          chunk_process_limit=DEFAULT_CHUNK_PROCESS_LIMIT):
+    """Streams chunks (an async or plain iterable of bytes) and yields every AddDataResponse.
+
+    Unlike recognize() there is no reconnect logic: connection problems raise
+    TransportError, bad server replies raise ServerError.
+    """
+    logger = logging.getLogger('asrclient')
+
+    connection = await Connection.open(server, port, enable_ssl=(port == 443), ipv4=ipv4)
+    try:
+        request = ('GET /asr_partial_checked HTTP/1.1\r\n'
+                   'User-Agent: {user_agent}\r\n'
+                   'Host: {host}:{port}\r\n'
+                   'Upgrade: {service}\r\n\r\n').format(
+                       user_agent=app,
+                       host=server,
+                       port=port,
+                       service=service)
+        if not await connection.upgrade(request, 'HTTP/1.1 101 Switching Protocols'):
+            raise ServerError('Unable to upgrade connection')
+        logger.info("Connected to {0}:{1}.".format(server, port))
+
+        connection.send_protobuf(make_connection_request(key, app, service, model, lang, format, uuid,
+                                                         inter_utt_silence, cmn_latency, biometry, not nopunctuation,
+                                                         capitalize, expected_num_count, snr, snr_flags, grammar_file,
+                                                         partial_results, allow_multi_utt, chunk_process_limit))
+        response = await connection.recv_protobuf(ConnectionResponse)
+        if response.responseCode != 200:
+            error_text = 'Wrong response from server, status_code={0}'.format(
+                response.responseCode)
+            if response.HasField("message"):
+                error_text += ', message is "{0}"'.format(response.message)
+            raise ServerError(error_text)
+        logger.info("session_id={0}".format(response.sessionId))
+
+        state = {'pending_answers': 0, 'last_chunk_sent': False}
+        answered = asyncio.Condition()
+
+        async def send_chunks():
+            async for chunk in _iterate(chunks):
+                async with answered:
+                    await answered.wait_for(lambda: state['pending_answers'] <= pending_limit)
+                connection.send_message_parts(add_data_parts(chunk))
+                state['pending_answers'] += 1
+                await connection.drain()
+            connection.send_message(LAST_CHUNK_MESSAGE)
+            state['pending_answers'] += 1
+            state['last_chunk_sent'] = True
+            await connection.drain()
+
+        sender = asyncio.ensure_future(send_chunks())
+        try:
+            while not (state['last_chunk_sent'] and state['pending_answers'] <= 0):
+                receiver = asyncio.ensure_future(connection.recv_protobuf(AddDataResponse, ConnectionResponse))
+                while not receiver.done():
+                    waiting = [receiver] if sender.done() else [receiver, sender]
+                    await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                    if sender.done() and sender.exception() is not None:
+                        receiver.cancel()
+                        raise sender.exception()
+                response = check_add_data_response(receiver.result())
+
+                async with answered:
+                    state['pending_answers'] -= response.messagesCount
+                    answered.notify_all()
+
+                yield response
+        finally:
+            sender.cancel()
+    finally:
+        connection.close()
+
+
+async def generate_async(text, speaker,
+                         server=ttsclient.DEFAULT_SERVER_VALUE,
+                         port=ttsclient.DEFAULT_PORT_VALUE,
+                         key=ttsclient.DEFAULT_KEY_VALUE,
+                         uuid=ttsclient.DEFAULT_UUID_VALUE,
+                         lang=ttsclient.DEFAULT_LANG_VALUE,
+                         emotion=None,
+                         gender=None,
+                         ipv4=False,
+                         format=ttsclient.DEFAULT_FORMAT_VALUE,
+                         quality=ttsclient.DEFAULT_QUALITY_VALUE,
+                         require_metainfo=False):
+    """Async counterpart of ttsclient.generate_stream(), yields SynthesisChunk as audio arrives."""
+    logger = logging.getLogger('asrclient')
+    request = ttsclient.make_generate_request(text, speaker, lang, emotion, gender, format, quality, require_metainfo)
+
+    connection = await Connection.open(server, port, enable_ssl=(port == 443), ipv4=ipv4)
+    try:
+        if not await connection.upgrade(ttsclient.UPGRADE_REQUEST.format(server, port), 'HTTP/1.1 101'):
+            raise ttsclient.TtsError("Wrong response on upgrade request.")
+        logger.info("Upgraded to protobuf, sending connect request.")
+
+        connection.send_protobuf(TtsConnectionRequest(
+            serviceName="tts",
+            speechkitVersion="ttsclient",
+            uuid=uuid,
+            apiKey=key
+        ))
+        connectionResponse = await connection.recv_protobuf(ConnectionResponse)
+        if connectionResponse.responseCode != 200:
+            raise ttsclient.TtsError("Bad response code %s: %s" % (connectionResponse.responseCode, connectionResponse.message))
+
+        # the proxy requires it before GenerateRequest
+        connection.send_protobuf(ParamsRequest(listVoices=True))
+        await connection.recv_protobuf(ParamsResponse)
+
+        connection.send_protobuf(request)
+        while True:
+            ttsResponse = await connection.recv_protobuf(GenerateResponse)
+            if ttsResponse.message:
+                raise ttsclient.SynthesisError("Error on synthesis: %s" % (ttsResponse.message,))
+
+            if ttsResponse.completed:
+                break
+            yield ttsclient.SynthesisChunk(ttsResponse.audioData, list(ttsResponse.words), list(ttsResponse.phonemes))
+    finally:
+        connection.close()
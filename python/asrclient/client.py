@@ -8,6 +8,10 @@ import sys
 import time
 import codecs
 import importlib
+import threading
+import collections
+import mmap
+import struct
 
 from uuid import uuid4 as randomUuid
 from socket import error as SocketError
@@ -15,11 +19,17 @@ from google.protobuf.message import DecodeError as DecodeProtobufError
 if sys.version_info >= (3, 0):
     from .basic_pb2 import ConnectionResponse
     from .voiceproxy_pb2 import ConnectionRequest, AddData, AddDataResponse, AdvancedASROptions, SnrFlag
-    from .transport import Transport, TransportError
+    from .transport import Transport, TransportError, encodeVarint
+    from .replay import ReplayBuffer
+    from .encoder import make_encoder, stream_format
+    import queue
 else:
     from basic_pb2 import ConnectionResponse
     from voiceproxy_pb2 import ConnectionRequest, AddData, AddDataResponse, AdvancedASROptions, SnrFlag
-    from transport import Transport, TransportError
+    from transport import Transport, TransportError, encodeVarint
+    from replay import ReplayBuffer
+    from encoder import make_encoder, stream_format
+    import Queue as queue
 from concurrent.futures import ThreadPoolExecutor, Future
 
 
@@ -39,9 +49,27 @@ DEFAULT_CHUNK_SIZE_VALUE = 1024*32*2
 DEFAULT_RECONNECT_DELAY = 0.5
 DEFAULT_RECONNECT_RETRY_COUNT = 5
 DEFAULT_PENDING_LIMIT = 50
+DEFAULT_CONCURRENCY = 4
+
+# How long the response reader blocks on the socket before rechecking whether the session is over.
+# It doesn't delay responses: select() returns as soon as data arrives.
+RESPONSE_WAIT_TIMEOUT = 1.0
 
 DEFAULT_INTER_UTT_SILENCE = 120
 DEFAULT_CMN_LATENCY = 50
+DEFAULT_CHUNK_PROCESS_LIMIT = 100
+
+# AddData wire encoding: field 1 (audioData) is length delimited, field 2 (lastChunk) is a varint
+ADD_DATA_AUDIO_TAG = b'\x0a'
+ADD_DATA_NOT_LAST = b'\x10\x00'
+ADD_DATA_LAST = b'\x10\x01'
+LAST_CHUNK_MESSAGE = AddData(lastChunk=True).SerializeToString()
+
+
+def add_data_parts(chunk, last=False):
+    """Serialized AddData(lastChunk=last, audioData=chunk) as a list of buffers, chunk itself is not copied."""
+    return [ADD_DATA_AUDIO_TAG + encodeVarint(len(chunk)), chunk, ADD_DATA_LAST if last else ADD_DATA_NOT_LAST]
+
 
 def bytes_in_sec(format):
     if "8000" in format:
@@ -75,14 +103,117 @@ def read_chunks_from_files(files, chunksize, start_from = 0, max_count = None):
         f.close()
 
 
+def find_wav_data(data):
+    """Returns offset of the samples in RIFF/WAVE file contents, 0 if data doesn't look like a wav file."""
+    if len(data) < 12 or data[0:4] != b'RIFF' or data[8:12] != b'WAVE':
+        return 0
+    offset = 12
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        chunk_size = struct.unpack('<I', data[offset + 4:offset + 8])[0]
+        if chunk_id == b'data':
+            return offset + 8
+        # chunks are word aligned
+        offset += 8 + chunk_size + (chunk_size & 1)
+    return 0
+
+
+def read_chunks_from_mmap(files, chunksize, start_from=0, max_count=None, skip_wav_header=True):
+    """Same as read_chunks_from_files, but yields memoryview slices of memory mapped files.
+
+    Nothing is read or copied until a chunk is actually sent, chunks before start_from are skipped
+    without touching the disk. Files must be regular files (objects with fileno() or paths).
+    Unlike read_chunks_from_files wav headers are not sent, unless skip_wav_header is False.
+    """
+    count = 0
+    for f in files:
+        if max_count is not None and count >= start_from + max_count:
+            break
+        if not hasattr(f, 'fileno'):
+            f = open(f, 'rb')
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                continue
+            # the mapping stays valid after the file is closed and lives as long as the views of it
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        view = memoryview(data)
+        if skip_wav_header:
+            view = view[find_wav_data(data):]
+        file_count = (len(view) + chunksize - 1) // chunksize
+        first = max(start_from - count, 0)
+        last = file_count if max_count is None else min(file_count, start_from + max_count - count)
+        for index in range(first, last):
+            yield view[index * chunksize:(index + 1) * chunksize]
+        count += file_count
+
+
 class ServerError(RuntimeError):
     def __init__(self, message):
         RuntimeError.__init__(self, message)
 
 
+# errors after which recognize() reconnects and resends the unfinished utterance
+CONNECTION_ERRORS = (DecodeProtobufError, ServerError, TransportError, SocketError)
+
+
+def parse_snr_flags(snr_flags):
+    if not snr_flags:
+        return []
+    elif isinstance(snr_flags, str) or isinstance(snr_flags, unicode):
+        return [a.split("=") for a in snr_flags.split(",")]
+    else:
+        return snr_flags
+
+
+def make_connection_request(key, app, service, topic, lang, format, uuid, inter_utt_silence, cmn_latency, biometry, punctuation=True, capitalize=False, expected_num_count=0, snr=False, snr_flags=None, grammar_file="", partial_results=True, allow_multi_utt=True, chunk_process_limit=DEFAULT_CHUNK_PROCESS_LIMIT):
+    advancedASROptions = AdvancedASROptions(
+        partial_results=partial_results,
+        allow_multi_utt=allow_multi_utt,
+        chunk_process_limit=chunk_process_limit,
+        utterance_silence=int(inter_utt_silence),
+        cmn_latency=cmn_latency,
+        capitalize=capitalize,
+        expected_num_count=expected_num_count,
+        biometry=biometry,
+        use_snr=snr,
+        snr_flags=[SnrFlag(name=a[0], value=a[1]) for a in parse_snr_flags(snr_flags)],
+    )
+    if len(grammar_file) > 0:
+        with codecs.open(grammar_file, encoding='utf-8') as grammar:
+            advancedASROptions.srgs = grammar.read()
+    return ConnectionRequest(
+        speechkitVersion='',
+        serviceName=service,
+        uuid=uuid,
+        apiKey=key,
+        applicationName=app,
+        device='desktop',
+        coords='0, 0',
+        topic=topic,
+        lang=lang,
+        format=format,
+        punctuation=punctuation,
+        advancedASROptions=advancedASROptions
+    )
+
+
+def check_add_data_response(response):
+    if isinstance(response, ConnectionResponse):
+        raise ServerError("Bad AddData response: %s %s" % (response.responseCode, response.message))
+
+    if response is not None:
+        if response.responseCode != 200:
+            error_text = 'Wrong response from server, status_code={0}'.format(
+                response.responseCode)
+            raise ServerError(error_text)
+
+    return response
+
+
 class ServerConnection(object):
 
-    def __init__(self, host, port, key, app, service, topic, lang, format, uuid, inter_utt_silence, cmn_latency, biometry, logger=None, punctuation=True, ipv4=False, capitalize=False, expected_num_count=0, snr=False, snr_flags=None, grammar_file=""):
+    def __init__(self, host, port, key, app, service, topic, lang, format, uuid, inter_utt_silence, cmn_latency, biometry, logger=None, punctuation=True, ipv4=False, capitalize=False, expected_num_count=0, snr=False, snr_flags=None, grammar_file="", partial_results=True, allow_multi_utt=True, chunk_process_limit=DEFAULT_CHUNK_PROCESS_LIMIT):
         self.host = host
         self.port = port
         self.key = key
@@ -101,15 +232,11 @@ class ServerConnection(object):
         self.capitalize = capitalize
         self.expected_num_count = expected_num_count
         self.snr = snr
-        
-        if not snr_flags:
-            self.snr_flags = []
-        elif isinstance(snr_flags, str) or isinstance(snr_flags, unicode):
-            self.snr_flags = [a.split("=") for a in snr_flags.split(",")]
-        else:
-            self.snr_flags = snr_flags
-        
+        self.snr_flags = parse_snr_flags(snr_flags)
         self.grammar_file = grammar_file
+        self.partial_results = partial_results
+        self.allow_multi_utt = allow_multi_utt
+        self.chunk_process_limit = chunk_process_limit
 
         self.log("uuid={0}".format(self.uuid))
 
@@ -122,6 +249,7 @@ class ServerConnection(object):
             self.logger.info(message)
 
     def connect(self):
+        connect_at = time.time()
         self.t = Transport(self.host, self.port, timeout=None, verbose=False, enable_ssl=(self.port==443), ipv4=self.ipv4)
         if not self.upgrade_connection():
             raise ServerError('Unable to upgrade connection')
@@ -137,37 +265,15 @@ class ServerConnection(object):
 
         self.session_id = response.sessionId
         self.log("session_id={0}".format(self.session_id))
+        self.handshake_time = time.time() - connect_at
 
         return self.session_id
 
     def send_init_request(self):
-        advancedASROptions = AdvancedASROptions(
-            utterance_silence=int(self.inter_utt_silence),
-            cmn_latency=self.cmn_latency,
-            capitalize=self.capitalize,
-            expected_num_count=self.expected_num_count,
-            biometry=self.biometry,
-            use_snr=self.snr,
-            snr_flags=[SnrFlag(name=a[0], value=a[1]) for a in self.snr_flags],
-        )
-        if len(self.grammar_file) > 0:
-            with codecs.open(self.grammar_file, encoding='utf-8') as grammar:
-                advancedASROptions.srgs = grammar.read()
-        request = ConnectionRequest(
-            speechkitVersion='',
-            serviceName=self.service,
-            uuid=self.uuid,
-            apiKey=self.key,
-            applicationName=self.app,
-            device='desktop',
-            coords='0, 0',
-            topic=self.topic,
-            lang=self.lang,
-            format=self.format,
-            punctuation=self.punctuation,
-            advancedASROptions=advancedASROptions
-        )
-
+        request = make_connection_request(self.key, self.app, self.service, self.topic, self.lang, self.format, self.uuid,
+                                          self.inter_utt_silence, self.cmn_latency, self.biometry, self.punctuation,
+                                          self.capitalize, self.expected_num_count, self.snr, self.snr_flags, self.grammar_file,
+                                          self.partial_results, self.allow_multi_utt, self.chunk_process_limit)
         self.t.sendProtobuf(request)
         return self.t.recvProtobuf(ConnectionResponse)
 
@@ -182,18 +288,11 @@ class ServerConnection(object):
                        port=self.port,
                        service=self.service)
 
-        self.t.send(request)
-        check = 'HTTP/1.1 101 Switching Protocols'
-        buffer = ''
-
-        # possible infinite loop here?
-        while True:
-            buffer += self.t.recv(1)
-            if buffer.startswith(check) and buffer.endswith('\r\n\r\n'):
-                return True
-            if len(buffer) > 300:
-                logger.warning(buffer)
-                return False
+        response = self.t.upgrade(request)
+        if response is None or not response.startswith(b'HTTP/1.1 101 Switching Protocols'):
+            logger.warning(response)
+            return False
+        return True
 
     def close(self):
         self.session_id = ""
@@ -207,28 +306,88 @@ class ServerConnection(object):
             time.sleep(delay)
         self.connect()
 
-    def add_data(self, chunk):
+    def add_data(self, chunk, last=False):
+        """Sends chunk, None is the last chunk marker, last=True sends chunk as the last one."""
         if chunk is None:
-            self.t.sendProtobuf(AddData(lastChunk=True))
+            self.t.sendMessage(LAST_CHUNK_MESSAGE)
         else:
-            self.t.sendProtobuf(AddData(lastChunk=False, audioData=chunk))
-
+            self.t.sendMessageParts(add_data_parts(chunk, last))
+
+
+    def get_response_if_ready(self, timeout=0):
+        return check_add_data_response(self.t.recvProtobufWithin(timeout, AddDataResponse, ConnectionResponse))
+
+
+def open_connection(format=DEFAULT_FORMAT_VALUE,
+                    server=DEFAULT_SERVER_VALUE,
+                    port=DEFAULT_PORT_VALUE,
+                    key=DEFAULT_KEY_VALUE,
+                    app='local',
+                    service='dictation',
+                    model=DEFAULT_MODEL_VALUE,
+                    lang=DEFAULT_LANG_VALUE,
+                    inter_utt_silence=DEFAULT_INTER_UTT_SILENCE,
+                    cmn_latency=DEFAULT_CMN_LATENCY,
+                    biometry="",
+                    uuid=DEFAULT_UUID_VALUE,
+                    ipv4=False,
+                    nopunctuation=False,
+                    capitalize=False,
+                    expected_num_count=0,
+                    snr=False,
+                    snr_flags=None,
+                    grammar_file="",
+                    partial_results=True,
+                    allow_multi_utt=True,
+                    chunk_process_limit=DEFAULT_CHUNK_PROCESS_LIMIT,
+                    compress=None,
+                    **kwargs):
+    """Connects a ServerConnection taking the same options as recognize(), the rest are ignored."""
+    return ServerConnection(server, port, key, app, service, model, lang, stream_format(compress, format), uuid, inter_utt_silence, cmn_latency, biometry, logging.getLogger('asrclient'), not nopunctuation, ipv4, capitalize, expected_num_count, snr, snr_flags, grammar_file, partial_results, allow_multi_utt, chunk_process_limit)
+
+
+class ConnectionPool(object):
+    """Keeps up to size connections upgraded and handshaken in background, ready to be taken.
+
+    A connection serves a single recognition, so every taken one is replaced with a fresh one
+    until limit connections were opened in total.
+    """
+
+    def __init__(self, factory, size=DEFAULT_CONCURRENCY, limit=None):
+        self.factory = factory
+        self.limit = limit
+        self.opened = 0
+        self.lock = threading.Lock()
+        self.ready = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=size)
+        for _ in range(size):
+            self.warm()
+
+    def warm(self):
+        with self.lock:
+            if self.limit is not None and self.opened >= self.limit:
+                return
+            self.opened += 1
+            self.ready.put(self.executor.submit(self.factory))
 
-    def get_response_if_ready(self):
-        response = self.t.recvProtobufIfAny(AddDataResponse, ConnectionResponse)
+    def acquire(self):
+        future = self.ready.get()
+        self.warm()
+        return future.result()
 
-        if isinstance(response, ConnectionResponse):
-            raise ServerError("Bad AddData response: %s %s" % (response.responseCode, response.message))
+    def close(self):
+        self.executor.shutdown(wait=True)
+        while not self.ready.empty():
+            future = self.ready.get()
+            if future.exception() is None:
+                future.result().close()
 
-        if response is not None:
-            if response.responseCode != 200:
-                error_text = 'Wrong response from server, status_code={0}'.format(
-                    response.responseCode)
-                if response.HasField("message"):
-                    error_text += ', message is "{0}"'.format(response.message)
-                raise ServerError(error_text)
+def call_safely(name, function, *args):
+    try:
+        function(*args)
+    except Exception as e:
+        print("Exception in {0}: ".format(name), e)
 
-        return response
 
 def recognize(chunks,
               callback=None,
@@ -256,7 +415,20 @@ def recognize(chunks,
               expected_num_count=0,
               snr=False,
               snr_flags=None,
-              grammar_file=""):
+              grammar_file="",
+              partial_results=True,
+              allow_multi_utt=True,
+              chunk_process_limit=DEFAULT_CHUNK_PROCESS_LIMIT,
+              partial_interval=0,
+              connection=None,
+              replay_limit=None,
+              replay_seconds=None,
+              replay_spill=False,
+              replay_spill_dir=None,
+              observer=None,
+              dispatcher=None,
+              compress=None,
+              encoder_pool=None):
 
     advanced_utterance_callback = None
     imported_module = None
@@ -274,127 +446,303 @@ def recognize(chunks,
         except AttributeError:
             print("No advanced utterrance callback in the imported module!")
 
+    def call_utterance_callback(correction, response, data_chunks):
+        # align_info of a resumed session starts from 0, the module reads the offset like session_id;
+        # it's set right before the call, which may run in a dispatcher worker
+        imported_module.correction_delta = correction
+        call_safely("advanced_utterance_callback", advanced_utterance_callback, response, data_chunks)
+
+    replay_bytes = replay_limit
+    if replay_seconds is not None:
+        replay_bytes = int(replay_seconds * bytes_in_sec(format))
+        if replay_limit is not None:
+            replay_bytes = min(replay_bytes, replay_limit)
 
     class PendingRecognition(object):
         def __init__(self):
             self.logger = logging.getLogger('asrclient')
             
-            self.server = ServerConnection(server, port, key, app, service, model, lang, format, uuid, inter_utt_silence, cmn_latency, biometry, self.logger, not nopunctuation, ipv4, capitalize, expected_num_count, snr, snr_flags, grammar_file)
-            self.unrecognized_chunks = []
+            if connection is not None:
+                self.server = connection
+            else:
+                self.server = ServerConnection(server, port, key, app, service, model, lang, stream_format(compress, format), uuid, inter_utt_silence, cmn_latency, biometry, self.logger, not nopunctuation, ipv4, capitalize, expected_num_count, snr, snr_flags, grammar_file, partial_results, allow_multi_utt, chunk_process_limit)
+            self.unrecognized_chunks = ReplayBuffer(replay_bytes, replay_spill, replay_spill_dir)
             self.retry_count = 0
             self.pending_answers = 0
             self.chunks_answered = 0
             self.utterance_start_index = 0
+            # stream offset of the first chunk in unrecognized_chunks, a resumed session starts there
+            self.utterance_start_bytes = 0
+            self.resumed = False
+            self.encoder = self.new_encoder()
             self.executor = ThreadPoolExecutor(max_workers=1)
             self.future = None
             self.last_end_time = 0
             self.correction_delta = 0
             self.last_chunk_sent = False
+            # set when recognition fails, so the response reader quits
+            self.stopped = False
+            # notified whenever pending_answers goes down or the response reader stops
+            self.answered = threading.Condition()
+            # send times of the chunks not answered yet, kept for the observer only
+            self.sent_at = collections.deque()
+            self.first_sent_at = None
+            self.got_response = False
+            # when the last partial result was passed to advanced_callback
+            self.partial_at = 0
+            # the newest partial result skipped since then
+            self.skipped_partial = None
+            if observer is not None:
+                observer.on_connect(self.server.handshake_time)
 
         def check_result(self):
-            while True:
-                try:
-                    response = self.server.get_response_if_ready()
+            try:
+                while not self.stopped and not (self.last_chunk_sent and self.pending_answers <= 0):
+                    try:
+                        response = self.server.get_response_if_ready(self.response_timeout())
+                    except CONNECTION_ERRORS:
+                        if self.last_chunk_sent and self.pending_answers <= 0:
+                            # everything is answered, the server may close the connection
+                            return
+                        raise
                     if response is not None:
                         self.on_response(response)
-                    if self.last_chunk_sent and self.pending_answers <= 0:
-                        return
-                    else:
-                        time.sleep(0.01)
-                except Exception as e:
-                    if self.pending_answers > 0:
-                        print("check result exception")
-                        print(type(e))
-                        print(e)
-                        raise e
-                    else:
-                        return
+                    if self.skipped_partial is not None and self.partial_due():
+                        self.on_partial(self.skipped_partial)
+            finally:
+                with self.answered:
+                    self.answered.notify_all()
+
+        def stop(self):
+            """Makes the response reader quit without waiting for the pending answers."""
+            self.stopped = True
+            self.server.close()
+            if self.future is not None:
+                # the error it stops with, if any, is of no interest now
+                self.future.exception()
+            self.executor.shutdown(wait=False)
+
+        def wait_answers(self, limit):
+            """Blocks until no more than limit answers are pending or the response reader stops."""
+            with self.answered:
+                while self.pending_answers > limit and not self.future.done():
+                    self.answered.wait(RESPONSE_WAIT_TIMEOUT)
+
+        def wait(self, timeout):
+            """Sleeps for timeout seconds, waking up early if the response reader stops."""
+            with self.answered:
+                if not self.future.done():
+                    self.answered.wait(timeout)
 
         def on_response(self, response):
 
             messages_count = response.messagesCount
             self.chunks_answered += messages_count
-            self.pending_answers -= messages_count
+            with self.answered:
+                self.pending_answers -= messages_count
+                self.answered.notify_all()
+
+            if observer is not None:
+                self.observe_response(response, messages_count)
+
+            if not response.endOfUtt and not self.partial_due():
+                # the newest one is handled when the interval is over
+                self.skipped_partial = response
+                return
 
             self.logger.info("got response: endOfUtt={0}; len(recognition)={1}; messages_count={2}".format(response.endOfUtt, len(response.recognition), messages_count))
 
+            delivered = False
             if response.endOfUtt:
                 if (len(response.recognition) > 0):
-                    start_time = response.recognition[0].align_info.start_time + self.correction_delta
                     end_time = response.recognition[0].align_info.end_time + self.correction_delta
-
-                    if start_time < self.last_end_time:
-                        self.correction_delta = self.last_end_time
-
-                    self.last_end_time = end_time
+                    # resent audio may end an utterance which was delivered before the reconnect
+                    delivered = self.resumed and end_time <= self.last_end_time
+                    if not delivered:
+                        self.last_end_time = end_time
+                self.partial_at = 0
+                self.skipped_partial = None
                 
-                if advanced_callback is not None:
-                    try:
-                        advanced_callback(response, self.correction_delta)
-                    except Exception as e:
-                        print("Exception in advanced_callback: ", e)
+                if advanced_callback is not None and not delivered:
+                    self.dispatch(call_safely, ("advanced_callback", advanced_callback, response, self.correction_delta))
             else:
-                if advanced_callback is not None:
-                    try:
-                        advanced_callback(response)
-                    except Exception as e:
-                        print("Exception in advanced_callback: ", e)
+                self.on_partial(response)
                 return
 
 
             self.logger.info('Chunks from {0} to {1}.'.format(self.utterance_start_index, self.utterance_start_index + self.chunks_answered))
 
-            if advanced_utterance_callback is not None:
-                try:
-                    advanced_utterance_callback(response, self.unrecognized_chunks[:self.chunks_answered])
-                except Exception as e:
-                    print("Exception in advanced_utterance_callback: ", e)
+            if delivered:
+                self.logger.info('The utterance was delivered before the reconnect, skipping it.')
+            elif advanced_utterance_callback is not None:
+                self.dispatch(call_utterance_callback, (self.correction_delta, response, self.unrecognized_chunks.head(self.chunks_answered)))
             elif callback is not None:
                 if (len(response.recognition) > 0):
                     start_time = response.recognition[0].align_info.start_time + self.correction_delta
                     end_time = response.recognition[0].align_info.end_time + self.correction_delta
                     utterance = response.recognition[0].normalized.encode('utf-8')
-                    callback(utterance, start_time, end_time, self.unrecognized_chunks[:self.chunks_answered])
+                    self.dispatch(callback, (utterance, start_time, end_time, self.unrecognized_chunks.head(self.chunks_answered)))
 
-            del self.unrecognized_chunks[:self.chunks_answered]
+            self.utterance_start_bytes += self.unrecognized_chunks.trim(self.chunks_answered)
             self.utterance_start_index += self.chunks_answered
             self.chunks_answered = 0
             self.retry_count = 0
 
-        def send(self, chunk):
+        def on_partial(self, response):
+            self.skipped_partial = None
+            if advanced_callback is not None:
+                self.dispatch(call_safely, ("advanced_callback", advanced_callback, response), partial=True)
+
+        def response_timeout(self):
+            """How long the reader may wait for a response, a skipped partial result is due at the end of the interval."""
+            if self.skipped_partial is None:
+                return RESPONSE_WAIT_TIMEOUT
+            return max(0, min(RESPONSE_WAIT_TIMEOUT, self.partial_at + partial_interval / 1000.0 - time.time()))
+
+        def partial_due(self):
+            """Whether partial_interval ms passed since the last partial result was handled, only the newest of the ones in between is kept."""
+            if not partial_interval:
+                return True
+            now = time.time()
+            if now - self.partial_at < partial_interval / 1000.0:
+                return False
+            self.partial_at = now
+            return True
+
+        def dispatch(self, function, args, partial=False):
+            """Calls function right here, or in the dispatcher's worker if there is one."""
+            if dispatcher is None:
+                function(*args)
+            else:
+                dispatcher.submit(self, function, args, partial)
+
+        def observe_response(self, response, messages_count):
+            now = time.time()
+            sent_at = now
+            for _ in range(min(messages_count, len(self.sent_at))):
+                sent_at = self.sent_at.popleft()
+            if not self.got_response:
+                self.got_response = True
+                observer.on_first_partial(now - self.first_sent_at)
+            observer.on_response(response, now - sent_at, self.pending_answers)
+            if response.endOfUtt:
+                observer.on_utterance(now - sent_at)
+
+        def new_encoder(self):
+            if compress is None:
+                return None
+            return make_encoder(compress, bytes_in_sec(format) // 2)
+
+        def encode_ahead(self, chunk):
+            """Starts compressing chunk in encoder_pool, so it's ready by the time it may be sent."""
+            if self.encoder is None or encoder_pool is None:
+                return None
+            return self.encoder, encoder_pool.submit(self.encoder.encode, chunk)
+
+        def encode(self, chunk, encoded=None):
+            # a chunk compressed ahead by the encoder of a lost session has to be compressed again
+            if encoded is not None and encoded[0] is self.encoder:
+                return encoded[1].result()
+            if chunk is None:
+                return self.encoder.finish()
+            return self.encoder.encode(chunk)
+
+        def send(self, chunk, encoded=None):
             self.logger.info("entering send() :start index {0}, pending answers {1}, chunks answered {2}".format(self.utterance_start_index, self.pending_answers, self.chunks_answered))
-            try:
-                self.server.add_data(chunk)
+            data = chunk
+            if self.encoder is not None:
+                data = self.encode(chunk, encoded)
+                if chunk is None and not data:
+                    data = None
+            # counted before sending, so the reader never sees more answers than pending ones
+            with self.answered:
                 self.pending_answers += 1
-                if chunk is None:
-                    self.last_chunk_sent = True
-            except (DecodeProtobufError, ServerError, TransportError, SocketError) as e:
-                self.logger.exception("Something bad happened, waiting for reconnect!")
-                time.sleep(1)
-                self.resendOnError()
-            except Exception as e:
-                self.logger.info("dbg send")
-                print(type(e))
-                print(e)
+            if chunk is None:
+                self.last_chunk_sent = True
+            if observer is not None:
+                self.sent_at.append(time.time())
+                if self.first_sent_at is None:
+                    self.first_sent_at = self.sent_at[-1]
+            # the end of a compressed stream goes with the last chunk marker
+            self.server.add_data(data, last=chunk is None)
+            if observer is not None:
+                observer.on_chunk_sent(len(data) if data is not None else 0, self.pending_answers)
+
+        def deliver(self, chunk, encoded=None):
+            """Keeps chunk for replay and sends it, resuming the session if the connection is lost."""
+            self.unrecognized_chunks.append(chunk)
+            try:
+                self.send(chunk, encoded)
+            except CONNECTION_ERRORS as e:
+                self.recover(e)
+
+        def check_reader(self):
+            """Resumes the session if the response reader stopped because of a connection error."""
+            if self.future.done():
+                error = self.future.exception()
+                if error is not None:
+                    if not isinstance(error, CONNECTION_ERRORS):
+                        raise error
+                    self.recover(error)
+
+        def recover(self, error):
+            """Reconnects and resends the audio not recognized yet, until it works or retries are over."""
+            while True:
+                self.logger.warning("Connection lost ({0}: {1}), resuming the session".format(type(error).__name__, error))
+                # the reader must be done with the old connection before the new one replaces it
+                self.server.close()
+                self.future.exception()
+                try:
+                    self.reconnectOnError()
+                    # the new reader must not see the state of the lost session
+                    self.resetOnError()
+                    self.future = self.executor.submit(self.check_result)
+                    self.resendOnError()
+                    return
+                except CONNECTION_ERRORS as e:
+                    error = e
 
         def reconnectOnError(self):
-            global retry_count
             if self.retry_count < reconnect_retry_count:
                 self.retry_count += 1
+                if observer is not None:
+                    observer.on_reconnect()
                 self.server.reconnect(reconnect_delay)
+                if observer is not None:
+                    observer.on_connect(self.server.handshake_time)
                 if imported_module is not None:
                     imported_module.session_id = self.server.session_id
             else:
                 raise RuntimeError("Gave up reconnecting!")
 
+        def resetOnError(self):
+            if self.unrecognized_chunks.dropped:
+                # dropped audio can't be resent, the new session starts after it
+                dropped = self.unrecognized_chunks.dropped
+                self.utterance_start_index += dropped
+                self.utterance_start_bytes += self.unrecognized_chunks.trim(dropped)
+            # the new session times its results from its own start
+            self.correction_delta = float(self.utterance_start_bytes) / bytes_in_sec(format)
+            # and gets a compressed stream of its own
+            self.encoder = self.new_encoder()
+            self.resumed = True
+            self.skipped_partial = None
+            with self.answered:
+                self.pending_answers = 0
+                self.chunks_answered = 0
+                self.last_chunk_sent = False
+            self.sent_at.clear()
+
         def resendOnError(self):
-            self.logger.info('Resending current utterance (chunks {0}-{1})...'.format(self.utterance_start_index, self.utterance_start_index + len(self.unrecognized_chunks)))
-            self.pending_answers = 0
-            self.chunks_answered = 0
+            self.logger.info('Resending current utterance (chunks {0}-{1}, from {2:.2f}s)...'.format(self.utterance_start_index, self.utterance_start_index + len(self.unrecognized_chunks), self.correction_delta))
+            if observer is not None:
+                resent = self.unrecognized_chunks.head(len(self.unrecognized_chunks))
+                observer.on_resend(len(resent), sum(len(chunk) for chunk in resent if chunk is not None))
             for i, chunk in enumerate(self.unrecognized_chunks):
 
-                while state.pending_answers > pending_limit:
-                    time.sleep(0.01)
+                self.wait_answers(pending_limit)
+                if self.future.done() and self.future.exception() is not None:
+                    raise self.future.exception()
 
                 if chunk is not None:
                     self.logger.info('About to send chunk {0} ({1} bytes)'.format(self.utterance_start_index + i, len(chunk)))
@@ -409,52 +757,49 @@ def recognize(chunks,
     state = PendingRecognition()
     if imported_module is not None:
         imported_module.session_id = state.server.session_id
+        imported_module.audio_format = format
+        imported_module.correction_delta = 0
 
     state.logger.info('Recognition was started.')
     chunks_count = 0
 
-    state.future = state.executor.submit(state.check_result)
-
-    sent_length = 0
-    for index, chunk in enumerate(chunks):
-
-        def check_future():
-            if not state.future.running():
-                state.logger.info("future not running!")
-                state.logger.info(state.future.exception())
-                return False
-            return True
-
-        def onError(exception):
-            state.logger.info('Connection lost! ({0})'.format(type(exception)))
-            state.logger.info(exception.message)
-            state.future.cancel()
-            state.reconnectOnError()
-            state.future = state.executor.submit(state.check_result)
-            state.resendOnError()
+    try:
+        state.future = state.executor.submit(state.check_result)
 
-        while realtime and (sent_length / bytes_in_sec(format) > time.time() - start_at):
-            time.sleep(0.01)
-            if not check_future():
-                onError(future.exception())
+        sent_length = 0
+        for index, chunk in enumerate(chunks):
+            if index == 0 and state.encoder is not None:
+                # the encoder takes bare samples
+                chunk = chunk[find_wav_data(chunk):]
+            encoded = state.encode_ahead(chunk)
 
+            while realtime and (float(sent_length) / bytes_in_sec(format) > time.time() - start_at):
+                state.wait(float(sent_length) / bytes_in_sec(format) - (time.time() - start_at))
+                state.check_reader()
 
-        while state.pending_answers > pending_limit:
-            time.sleep(0.01)
-            if not check_future():
-                onError(state.future.exception())
+            while state.pending_answers > pending_limit:
+                state.wait_answers(pending_limit)
+                state.check_reader()
 
-        state.logger.info('About to send chunk {0} ({1} bytes)'.format(index, len(chunk)))
-        state.unrecognized_chunks.append(chunk)
-        state.send(chunk)
-        chunks_count = index + 1
-        sent_length += len(chunk)
+            state.logger.info('About to send chunk {0} ({1} bytes)'.format(index, len(chunk)))
+            state.deliver(chunk, encoded)
+            chunks_count = index + 1
+            sent_length += len(chunk)
 
-    state.logger.info('No more chunks. Finalizing recognition.')
-    state.unrecognized_chunks.append(None)
-    state.send(None)
+        state.logger.info('No more chunks. Finalizing recognition.')
+        state.deliver(None)
 
-    state.future.result()
+        while True:
+            try:
+                state.future.result()
+                break
+            except CONNECTION_ERRORS as e:
+                state.recover(e)
+    except BaseException:
+        state.stop()
+        raise
+    if dispatcher is not None:
+        dispatcher.wait(state)
 
     state.logger.info('Recognition is done.')
 
@@ -466,4 +811,78 @@ def recognize(chunks,
                                                                           seconds_elapsed))
     chunks_per_second = chunks_count / seconds_elapsed
     state.logger.info("Avg. {0} chunks per second".format(chunks_per_second))
+    if observer is not None:
+        observer.on_finish(seconds_elapsed)
     state.server.close()
+
+
+def recognize_many(sources,
+                   callback=None,
+                   advanced_callback=None,
+                   concurrency=DEFAULT_CONCURRENCY,
+                   done_callback=None,
+                   **kwargs):
+    """Recognizes every source (an iterable of chunks) in a session of its own, concurrency sessions at a time.
+
+    Connections for the next sources are opened and handshaken while the current ones are streaming.
+    callback and advanced_callback take the source index as the first argument, calls for a single source
+    come in the order of its audio. done_callback(index, error) is called when a source is finished,
+    error is None on success. Other arguments are the same as for recognize().
+
+    Returns aggregate statistics: sources and failed counts, per-source errors, elapsed seconds,
+    bytes and audio seconds sent and throughput.
+    """
+    logger = logging.getLogger('asrclient')
+    sources = list(sources)
+    sent_bytes = [0] * len(sources)
+    errors = [None] * len(sources)
+
+    def counted(index, chunks):
+        for chunk in chunks:
+            sent_bytes[index] += len(chunk)
+            yield chunk
+
+    def bind(function, index):
+        if function is None:
+            return None
+        return lambda *args: function(index, *args)
+
+    def run(index):
+        try:
+            recognize(counted(index, sources[index]),
+                      callback=bind(callback, index),
+                      advanced_callback=bind(advanced_callback, index),
+                      connection=pool.acquire(),
+                      **kwargs)
+        except Exception as e:
+            logger.exception("Recognition of source {0} failed".format(index))
+            errors[index] = e
+        if done_callback is not None:
+            done_callback(index, errors[index])
+
+    start_at = time.time()
+
+    # an empty batch opens no connections at all
+    if sources:
+        pool = ConnectionPool(lambda: open_connection(**kwargs), size=min(concurrency, len(sources)), limit=len(sources))
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(run, range(len(sources))))
+        finally:
+            pool.close()
+
+    seconds_elapsed = max(time.time() - start_at, 1e-6)
+    audio_seconds = float(sum(sent_bytes)) / bytes_in_sec(kwargs.get('format', DEFAULT_FORMAT_VALUE))
+    stats = {
+        'sources': len(sources),
+        'failed': len([e for e in errors if e is not None]),
+        'errors': errors,
+        'seconds': seconds_elapsed,
+        'bytes': sum(sent_bytes),
+        'audio_seconds': audio_seconds,
+        'sources_per_second': len(sources) / seconds_elapsed,
+        'audio_seconds_per_second': audio_seconds / seconds_elapsed,
+    }
+    logger.info("Recognized {0} sources ({1} failed) in {2:.2f} seconds: {3:.2f} sources per second, {4:.2f} audio seconds per second".format(
+        stats['sources'], stats['failed'], seconds_elapsed, stats['sources_per_second'], stats['audio_seconds_per_second']))
+    return stats
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Running recognition callbacks off the response reading thread.
+
+    dispatcher = CallbackDispatcher(workers=4, queue_size=100, policy=COALESCE_PARTIALS)
+    client.recognize_many(sources, advanced_callback=save, dispatcher=dispatcher)
+    dispatcher.close()
+"""
+
+import collections
+import logging
+import threading
+
+BLOCK = 'block'
+DROP_PARTIALS = 'drop_partials'
+COALESCE_PARTIALS = 'coalesce_partials'
+POLICIES = [BLOCK, DROP_PARTIALS, COALESCE_PARTIALS]
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 100
+
+
+class CallbackDispatcher(object):
+    """Bounded queue of callback calls served by a pool of worker threads.
+
+    Calls are submitted under a key (recognize() uses one per session), calls of a key run one
+    at a time in submission order, different keys run in parallel. When queue_size calls are
+    waiting, policy decides what happens to a new one:
+
+    block             - the submitting thread waits for a free place
+    drop_partials     - calls for partial results are dropped, the rest wait
+    coalesce_partials - like block, but a waiting partial call of the same key is always replaced
+                        by the newer one, so a slow consumer gets only the latest partials
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE, policy=BLOCK):
+        if policy not in POLICIES:
+            raise ValueError("Unknown dispatch policy {0}, expected one of {1}".format(policy, ", ".join(POLICIES)))
+        self.queue_size = queue_size
+        self.policy = policy
+        self.lock = threading.Condition()
+        # key -> deque of (function, args, partial) waiting to run
+        self.calls = {}
+        # keys having calls and no running one
+        self.ready = collections.deque()
+        self.running = set()
+        self.waiting = 0
+        self.dropped = 0
+        self.closed = False
+        self.logger = logging.getLogger('asrclient')
+        self.threads = [threading.Thread(target=self.work) for _ in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, key, function, args=(), partial=False):
+        """Queues function(*args), partial tells whether it's a call for a partial result."""
+        with self.lock:
+            calls = self.calls.get(key)
+            if partial and self.policy == COALESCE_PARTIALS and calls and calls[-1][2]:
+                calls[-1] = (function, args, partial)
+                self.dropped += 1
+                return
+            while self.waiting >= self.queue_size and not self.closed:
+                if partial and self.policy == DROP_PARTIALS:
+                    self.dropped += 1
+                    return
+                self.lock.wait()
+            if self.closed:
+                raise RuntimeError("Dispatcher is closed")
+            calls = self.calls.get(key)
+            if calls is None:
+                calls = self.calls[key] = collections.deque()
+                if key not in self.running:
+                    self.ready.append(key)
+            calls.append((function, args, partial))
+            self.waiting += 1
+            self.lock.notify_all()
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.ready and not self.closed:
+                    self.lock.wait()
+                if not self.ready:
+                    return
+                key = self.ready.popleft()
+                calls = self.calls[key]
+                function, args, _ = calls.popleft()
+                if not calls:
+                    del self.calls[key]
+                self.running.add(key)
+                self.waiting -= 1
+                self.lock.notify_all()
+            try:
+                function(*args)
+            except Exception:
+                self.logger.exception("Exception in a dispatched callback")
+            finally:
+                with self.lock:
+                    self.running.discard(key)
+                    if key in self.calls:
+                        self.ready.append(key)
+                    self.lock.notify_all()
+
+    def wait(self, key):
+        """Blocks until every call of key submitted so far is done."""
+        with self.lock:
+            while key in self.calls or key in self.running:
+                self.lock.wait()
+
+    def close(self):
+        """Runs the calls already queued and stops the workers."""
+        with self.lock:
+            while self.calls or self.running:
+                self.lock.wait()
+            self.closed = True
+            self.lock.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compressing PCM audio on the client before it is sent for recognition.
+
+    pool = ThreadPoolExecutor(max_workers=4)
+    client.recognize(chunks, compress='opus', encoder_pool=pool)
+
+Opus needs the opuslib module (and libopus), it's imported only when an encoder is created.
+"""
+
+import random
+import struct
+
+DEFAULT_BITRATE = 24000
+DEFAULT_FRAME_MS = 20
+
+OPUS_FORMAT = 'audio/ogg;codecs=opus'
+# Ogg Opus granule positions always count 48kHz samples
+OPUS_GRANULE_RATE = 48000
+# samples of the encoder delay at 48kHz to be skipped by the decoder
+OPUS_PRE_SKIP = 312
+
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+OPUS_HEAD = struct.Struct('<8sBBHIhB')
+BEGIN_OF_STREAM = 0x02
+END_OF_STREAM = 0x04
+MAX_SEGMENTS = 255
+
+
+def make_crc_table():
+    table = []
+    for i in range(256):
+        r = i << 24
+        for _ in range(8):
+            r = ((r << 1) ^ 0x04c11db7) if r & 0x80000000 else (r << 1)
+        table.append(r & 0xffffffff)
+    return table
+
+CRC_TABLE = make_crc_table()
+
+
+def ogg_crc(data):
+    """CRC of an Ogg page: polynomial 0x04c11db7, no reflection, zero initial and final values."""
+    crc = 0
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xffffffff) ^ CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def lacing(size):
+    return [255] * (size // 255) + [size % 255]
+
+
+class OggWriter(object):
+    """Packs packets of a single logical stream into Ogg pages."""
+
+    def __init__(self, serial=None):
+        self.serial = random.getrandbits(32) if serial is None else serial
+        self.sequence = 0
+
+    def page(self, packets, granule, flags=0):
+        segments = []
+        for packet in packets:
+            segments.extend(lacing(len(packet)))
+        header = PAGE_HEADER.pack(b'OggS', 0, flags, granule, self.serial, self.sequence, 0, len(segments))
+        page = bytearray(header)
+        page.extend(bytearray(segments))
+        for packet in packets:
+            page.extend(packet)
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+        self.sequence += 1
+        return bytes(page)
+
+    def pages(self, packets, granules, last=False):
+        """Returns pages with packets, granules[i] is the position at the end of packets[i]."""
+        result = []
+        start = 0
+        segments = 0
+        for i, packet in enumerate(packets):
+            count = len(lacing(len(packet)))
+            if segments + count > MAX_SEGMENTS:
+                result.append(self.page(packets[start:i], granules[i - 1]))
+                start, segments = i, 0
+            segments += count
+        result.append(self.page(packets[start:], granules[-1], END_OF_STREAM if last else 0))
+        return b''.join(result)
+
+
+class OggOpusEncoder(object):
+    """Encodes 16-bit mono PCM into an Ogg Opus stream.
+
+    encode() takes PCM of any length and returns the pages of the frames completed so far,
+    the rest is kept for the next call. finish() encodes it padded with silence and ends the stream.
+    """
+
+    format = OPUS_FORMAT
+
+    def __init__(self, sample_rate=16000, bitrate=DEFAULT_BITRATE, frame_ms=DEFAULT_FRAME_MS):
+        import opuslib
+        self.encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self.encoder.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * 2
+        self.ogg = OggWriter()
+        self.rest = b''
+        self.granule = OPUS_PRE_SKIP
+        self.started = False
+
+    def headers(self):
+        head = OPUS_HEAD.pack(b'OpusHead', 1, 1, OPUS_PRE_SKIP, self.sample_rate, 0, 0)
+        vendor = b'asrclient'
+        tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+        return self.ogg.page([head], 0, BEGIN_OF_STREAM) + self.ogg.page([tags], 0)
+
+    def advance(self, samples):
+        self.granule += samples * OPUS_GRANULE_RATE // self.sample_rate
+        return self.granule
+
+    def encode(self, pcm, last=False):
+        data = self.rest + bytes(pcm)
+        end = len(data) - len(data) % self.frame_bytes
+        packets = []
+        granules = []
+        for offset in range(0, end, self.frame_bytes):
+            packets.append(self.encoder.encode(data[offset:offset + self.frame_bytes], self.frame_samples))
+            granules.append(self.advance(self.frame_samples))
+        self.rest = data[end:]
+        if last and self.rest:
+            # padding is cut off by the granule position of the last page
+            packets.append(self.encoder.encode(self.rest.ljust(self.frame_bytes, b'\0'), self.frame_samples))
+            granules.append(self.advance(len(self.rest) // 2))
+            self.rest = b''
+
+        result = b''
+        if not self.started:
+            self.started = True
+            result = self.headers()
+        if packets:
+            result += self.ogg.pages(packets, granules, last)
+        elif last:
+            result += self.ogg.page([], self.granule, END_OF_STREAM)
+        return result
+
+    def finish(self):
+        return self.encode(b'', last=True)
+
+
+ENCODERS = {
+    'opus': OggOpusEncoder,
+}
+
+
+def encoder_class(name):
+    if name not in ENCODERS:
+        raise ValueError("Unknown audio encoder {0}, expected one of {1}".format(name, ", ".join(sorted(ENCODERS))))
+    return ENCODERS[name]
+
+
+def make_encoder(name, sample_rate, **kwargs):
+    return encoder_class(name)(sample_rate, **kwargs)
+
+
+def stream_format(name, format):
+    """Format of the audio the server gets: format itself when there is no encoder name."""
+    if name is None:
+        return format
+    return encoder_class(name).format
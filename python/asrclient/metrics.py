@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Recognition session instrumentation.
+
+Pass an observer to recognize() to see what happens inside a session:
+
+    stats = RecognitionStats()
+    client.recognize(chunks, observer=stats)
+    print(stats.as_dict())
+
+Without an observer recognize() doesn't even take timestamps for it.
+"""
+
+import threading
+
+
+class RecognitionObserver(object):
+    """Receives recognize() session events. Every method does nothing, override the ones you need.
+
+    Methods may be called from the sending and from the response reading threads.
+    """
+
+    def on_connect(self, handshake_seconds):
+        """Connected, upgraded and got ConnectionResponse, handshake_seconds is how long it took."""
+
+    def on_chunk_sent(self, size, pending_answers):
+        """Sent an AddData message with size audio bytes, pending_answers is the queue depth after it."""
+
+    def on_response(self, response, latency_seconds, pending_answers):
+        """Got an AddDataResponse, latency_seconds since the last chunk it answers was sent."""
+
+    def on_first_partial(self, seconds):
+        """Got the first response of the session, seconds since the first chunk was sent."""
+
+    def on_utterance(self, latency_seconds):
+        """Got an endOfUtt response, latency_seconds since the last chunk of the utterance was sent."""
+
+    def on_reconnect(self):
+        """Connection was lost and is going to be reestablished."""
+
+    def on_resend(self, chunks, size):
+        """Resending chunks with size audio bytes after a reconnect."""
+
+    def on_finish(self, seconds):
+        """Recognition is done, it took seconds overall."""
+
+
+class RecognitionStats(RecognitionObserver):
+    """Collects observed events, may be shared by several sessions (e.g. by recognize_many())."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self.handshake_seconds = []
+        self.first_partial_seconds = []
+        self.response_latencies = []
+        self.utterance_latencies = []
+        self.chunks_sent = 0
+        self.bytes_sent = 0
+        self.responses = 0
+        self.max_pending_answers = 0
+        self.reconnects = 0
+        self.resent_chunks = 0
+        self.resent_bytes = 0
+        self.seconds = []
+
+    def on_connect(self, handshake_seconds):
+        with self.lock:
+            self.handshake_seconds.append(handshake_seconds)
+
+    def on_chunk_sent(self, size, pending_answers):
+        with self.lock:
+            self.chunks_sent += 1
+            self.bytes_sent += size
+            self.max_pending_answers = max(self.max_pending_answers, pending_answers)
+
+    def on_response(self, response, latency_seconds, pending_answers):
+        with self.lock:
+            self.responses += 1
+            self.response_latencies.append(latency_seconds)
+
+    def on_first_partial(self, seconds):
+        with self.lock:
+            self.first_partial_seconds.append(seconds)
+
+    def on_utterance(self, latency_seconds):
+        with self.lock:
+            self.utterance_latencies.append(latency_seconds)
+
+    def on_reconnect(self):
+        with self.lock:
+            self.reconnects += 1
+
+    def on_resend(self, chunks, size):
+        with self.lock:
+            self.resent_chunks += chunks
+            self.resent_bytes += size
+
+    def on_finish(self, seconds):
+        with self.lock:
+            self.sessions += 1
+            self.seconds.append(seconds)
+
+    def as_dict(self):
+        """Counters and averages, handy for logging or exporting to a monitoring system."""
+        def average(values):
+            return sum(values) / len(values) if values else None
+
+        with self.lock:
+            return {
+                'sessions': self.sessions,
+                'handshake_seconds': average(self.handshake_seconds),
+                'first_partial_seconds': average(self.first_partial_seconds),
+                'response_latency_seconds': average(self.response_latencies),
+                'utterance_latency_seconds': average(self.utterance_latencies),
+                'utterance_latency_max_seconds': max(self.utterance_latencies) if self.utterance_latencies else None,
+                'chunks_sent': self.chunks_sent,
+                'bytes_sent': self.bytes_sent,
+                'responses': self.responses,
+                'max_pending_answers': self.max_pending_answers,
+                'reconnects': self.reconnects,
+                'resent_chunks': self.resent_chunks,
+                'resent_bytes': self.resent_bytes,
+            }
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Yandex ASR and TTS servers.
+
+It speaks the same upgrade handshake and hex framed protobuf protocol as
+asr.yandex.net (/asr_partial*) and tts.voicetech.yandex.net (/ytcp*), so
+client throughput and reconnect behaviour can be tested and benchmarked
+without network access or an API key. Recognition results are made up,
+synthesized audio is silence.
+
+    with MockServer(messages_count=3, latency=0.05) as server:
+        client.recognize(chunks, server=server.host, port=server.port)
+
+or from the command line:
+
+    python -m asrclient.mockserver --port 8089
+"""
+
+import logging
+import random
+import socket
+import sys
+import threading
+import time
+
+from uuid import uuid4 as randomUuid
+
+if sys.version_info >= (3, 0):
+    import socketserver
+    from .transport import Transport, TransportError, setNoDelay, server as DEFAULT_HOST, port as DEFAULT_PORT
+    from .basic_pb2 import ConnectionResponse
+    from .voiceproxy_pb2 import ConnectionRequest, AddData, AddDataResponse, Result, Word, AlignInfo
+    from .tts_pb2 import ConnectionRequest as TtsConnectionRequest, ParamsRequest, ParamsResponse, GenerateRequest
+    from .ttsbackend_pb2 import GenerateResponse
+    from .client import bytes_in_sec
+else:
+    import SocketServer as socketserver
+    from transport import Transport, TransportError, setNoDelay, server as DEFAULT_HOST, port as DEFAULT_PORT
+    from basic_pb2 import ConnectionResponse
+    from voiceproxy_pb2 import ConnectionRequest, AddData, AddDataResponse, Result, Word, AlignInfo
+    from tts_pb2 import ConnectionRequest as TtsConnectionRequest, ParamsRequest, ParamsResponse, GenerateRequest
+    from ttsbackend_pb2 import GenerateResponse
+    from client import bytes_in_sec
+
+
+DEFAULT_TEXT = u'привет мир'
+DEFAULT_VOICES = [
+    # name, gender, language id, sample rate
+    ('alyss', 1, 0x419, 48000),
+    ('jane', 1, 0x419, 48000),
+    ('oksana', 1, 0x419, 48000),
+    ('omazh', 1, 0x419, 48000),
+    ('zahar', 2, 0x419, 48000),
+    ('ermil', 2, 0x419, 48000),
+]
+
+MAX_UPGRADE_REQUEST_SIZE = 4096
+
+# synthesized speech length per character of the text
+TTS_SECONDS_PER_CHAR = 0.06
+TTS_SAMPLE_RATES = {GenerateRequest.Low: 8000, GenerateRequest.High: 16000, GenerateRequest.UltraHigh: 48000}
+
+
+class Fault(Exception):
+    """Raised inside a session to drop the connection."""
+
+
+class MockServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded server, every connection is served by a thread of its own.
+
+    messages_count    - at most that many already received AddData messages are answered with one response
+    utterance_chunks  - every that many chunks make an utterance (endOfUtt response)
+    latency           - seconds to wait before every response
+    fault_rate        - probability to drop the connection on a received message
+    fault_every       - drop the connection on every that many messages received by the whole server
+    error_rate        - probability to answer AddData with the InternalError response code
+    key               - if set, other api keys are rejected
+    tts_chunk_size    - audio bytes per GenerateResponse
+    seed              - seed of the fault and error random generator
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, messages_count=1, utterance_chunks=5, latency=0.0,
+                 fault_rate=0.0, fault_every=None, error_rate=0.0, key=None, text=DEFAULT_TEXT, voices=DEFAULT_VOICES,
+                 tts_chunk_size=4096, seed=None):
+        self.messages_count = messages_count
+        self.utterance_chunks = utterance_chunks
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.fault_every = fault_every
+        self.error_rate = error_rate
+        self.key = key
+        self.text = text
+        self.voices = voices
+        self.tts_chunk_size = tts_chunk_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.messages_received = 0
+        self.sessions = 0
+        self.faults = 0
+        self.thread = None
+        self.logger = logging.getLogger('asrclient.mockserver')
+        socketserver.TCPServer.__init__(self, (host, port), MockHandler)
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serves in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def on_message(self):
+        with self.lock:
+            self.messages_received += 1
+            fault = (self.fault_every is not None and self.messages_received % self.fault_every == 0) or \
+                (self.fault_rate > 0 and self.random.random() < self.fault_rate)
+            if fault:
+                self.faults += 1
+        if fault:
+            raise Fault()
+
+    def roll_error(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+
+class MockHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        setNoDelay(self.request)
+        t = Transport.fromSocket(self.request)
+        try:
+            request = t.recvUntil(b'\r\n\r\n', MAX_UPGRADE_REQUEST_SIZE)
+            if request is None:
+                return
+            path = request.split(b' ')[1] if request.count(b' ') else b''
+            if path.startswith(b'/asr_partial'):
+                session = self.recognize
+            elif path.startswith(b'/ytcp'):
+                session = self.generate
+            else:
+                t.send('HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n')
+                return
+            t.send('HTTP/1.1 101 Switching Protocols\r\nUpgrade: protobuf\r\nConnection: Upgrade\r\n\r\n')
+            with server.lock:
+                server.sessions += 1
+            session(t)
+        except Fault:
+            server.logger.info('Dropping connection on purpose')
+        except (TransportError, socket.error) as e:
+            server.logger.info('Connection closed: {0}'.format(e))
+        finally:
+            t.close()
+
+    def connect(self, t, request_type):
+        server = self.server
+        request = t.recvProtobuf(request_type)
+        server.on_message()
+        server.delay()
+        if server.key is not None and request.apiKey != server.key:
+            t.sendProtobuf(ConnectionResponse(responseCode=ConnectionResponse.InvalidKey, sessionId='', message='Invalid api key'))
+            return None
+        t.sendProtobuf(ConnectionResponse(responseCode=200, sessionId=randomUuid().hex))
+        return request
+
+    def recognize(self, t):
+        server = self.server
+        request = self.connect(t, ConnectionRequest)
+        if request is None:
+            return
+        rate = bytes_in_sec(request.format)
+        words = server.text.split()
+
+        received_bytes = 0
+        utterance_start = 0
+        utterance_chunks = 0
+        while True:
+            # merge whatever is already here, like the real server does when it lags behind
+            merged = 0
+            last_chunk = False
+            while not last_chunk and merged < server.messages_count and (merged == 0 or t.readable()):
+                data = AddData()
+                data.ParseFromString(t.recvMessage())
+                server.on_message()
+                received_bytes += len(data.audioData)
+                utterance_chunks += 1
+                merged += 1
+                last_chunk = data.lastChunk
+                if utterance_chunks >= server.utterance_chunks:
+                    break
+
+            server.delay()
+            if server.roll_error():
+                t.sendProtobuf(AddDataResponse(responseCode=ConnectionResponse.InternalError, messagesCount=merged))
+                continue
+
+            end_of_utt = last_chunk or utterance_chunks >= server.utterance_chunks
+            start_time = float(utterance_start) / rate
+            end_time = float(received_bytes) / rate
+            if end_of_utt:
+                recognized = words
+            else:
+                recognized = words[:max(1, len(words) * utterance_chunks // server.utterance_chunks)]
+            step = (end_time - start_time) / max(len(recognized), 1)
+            result = Result(
+                confidence=1.0,
+                normalized=u' '.join(recognized),
+                words=[Word(confidence=1.0, value=w, align_info=AlignInfo(start_time=start_time + i * step, end_time=start_time + (i + 1) * step))
+                       for i, w in enumerate(recognized)],
+                align_info=AlignInfo(start_time=start_time, end_time=end_time))
+            t.sendProtobuf(AddDataResponse(responseCode=200, recognition=[result], endOfUtt=end_of_utt, messagesCount=merged))
+
+            if end_of_utt:
+                utterance_start = received_bytes
+                utterance_chunks = 0
+            if last_chunk:
+                return
+
+    def generate(self, t):
+        server = self.server
+        if self.connect(t, TtsConnectionRequest) is None:
+            return
+        while True:
+            message = t.recvMessage()
+            server.on_message()
+            if not message:
+                # StopGeneration with nothing to stop
+                continue
+            request = GenerateRequest()
+            try:
+                request.ParseFromString(message)
+            except Exception:
+                pass
+            # the only other message with content, it has none of the required GenerateRequest fields
+            if not request.IsInitialized():
+                params = ParamsRequest()
+                params.ParseFromString(message)
+                server.delay()
+                t.sendProtobuf(ParamsResponse(voiceList=[
+                    ParamsResponse.Voice(name=name, gender=gender, languageId=language, initialSampleFreq=rate,
+                                         displayName=name.capitalize(), coreVoice=True)
+                    for name, gender, language, rate in (server.voices if params.listVoices else [])]))
+                continue
+            self.synthesize(t, request)
+
+    def synthesize(self, t, request):
+        server = self.server
+        if request.voice not in [v[0] for v in server.voices]:
+            server.delay()
+            t.sendProtobuf(GenerateResponse(completed=True, responseCode=ConnectionResponse.InvalidRequestParams,
+                                            message='Unknown voice {0}'.format(request.voice)))
+            return
+
+        rate = TTS_SAMPLE_RATES.get(request.quality, 16000)
+        audio_size = int(len(request.text) * TTS_SECONDS_PER_CHAR * rate) * 2
+        sent = 0
+        first = True
+        while sent < audio_size:
+            if t.readable() and not t.recvMessage():
+                break  # StopGeneration
+            server.delay()
+            size = min(server.tts_chunk_size, audio_size - sent)
+            response = GenerateResponse(completed=False, audioData=b'\x00' * size)
+            if first and request.requireMetainfo:
+                position = 0
+                for word in request.text.split():
+                    response.words.add(firstCharPositionInText=request.text.index(word, position),
+                                       bytesLengthInSignal=int(len(word) * TTS_SECONDS_PER_CHAR * rate) * 2,
+                                       text=word)
+                    position = request.text.index(word, position) + len(word)
+            first = False
+            t.sendProtobuf(response)
+            sent += size
+        t.sendProtobuf(GenerateResponse(completed=True))
+
+
+def main():
+    import click
+
+    @click.command()
+    @click.option('--host', default=DEFAULT_HOST, help='Default is {0}.'.format(DEFAULT_HOST))
+    @click.option('-p', '--port', default=DEFAULT_PORT, help='Default is {0}.'.format(DEFAULT_PORT))
+    @click.option('--messages-count', default=1, help='How many AddData messages may be merged into one response. Default is 1.')
+    @click.option('--utterance-chunks', default=5, help='Chunks per utterance. Default is 5.')
+    @click.option('--latency', default=0.0, help='Seconds to wait before every response. Default is 0.')
+    @click.option('--fault-rate', default=0.0, help='Probability to drop the connection on a received message. Default is 0.')
+    @click.option('--fault-every', default=None, type=int, help='Drop a connection on every that many received messages.')
+    @click.option('--error-rate', default=0.0, help='Probability to answer AddData with an error. Default is 0.')
+    @click.option('--key', default=None, help='Accept only this api key. Default is to accept any.')
+    @click.option('--seed', default=None, type=int, help='Random seed for faults and errors.')
+    @click.option('--silent', is_flag=True, help='Don\'t print debug messages.')
+    def run(host, port, silent, **kwargs):
+        if not silent:
+            logging.basicConfig(level=logging.INFO)
+        server = MockServer(host, port, **kwargs)
+        click.echo('Listening on {0}:{1}'.format(server.host, server.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Storage for audio chunks which may have to be sent again."""
+
+import collections
+import logging
+import tempfile
+import threading
+
+
+class ReplayBuffer(object):
+    """Chunks sent since the last end of utterance, in sending order.
+
+    They are resent after a reconnect and handed to utterance callbacks. At most max_bytes of audio
+    is kept in memory (no limit by default), older chunks above the limit are moved to a temporary
+    file in spill_dir when spill is enabled, otherwise they are dropped. Chunk positions passed to
+    head() and trim() always count dropped chunks too.
+    """
+
+    def __init__(self, max_bytes=None, spill=False, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self.logger = logging.getLogger('asrclient')
+        self.lock = threading.RLock()
+        self.dropped = 0
+        # sizes of the dropped chunks, their audio is gone but their place in the stream is still needed
+        self.dropped_sizes = collections.deque()
+        # (offset, length) records of the oldest chunks, length is None for the last chunk marker
+        self.spilled = collections.deque()
+        self.spill_file = None
+        self.spill_size = 0
+        self.memory = collections.deque()
+        self.memory_bytes = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.dropped + len(self.spilled) + len(self.memory)
+
+    def __iter__(self):
+        with self.lock:
+            spill_file = self.spill_file
+            spilled = list(self.spilled)
+            memory = list(self.memory)
+        for offset, length in spilled:
+            yield self.read(spill_file, offset, length)
+        for chunk in memory:
+            yield chunk
+
+    def append(self, chunk):
+        with self.lock:
+            self.memory.append(chunk)
+            self.memory_bytes += len(chunk) if chunk is not None else 0
+            while self.max_bytes is not None and self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+                old = self.memory.popleft()
+                self.memory_bytes -= len(old) if old is not None else 0
+                if self.spill:
+                    self.spilled.append(self.write(old))
+                else:
+                    if not self.dropped:
+                        self.logger.warning("Replay buffer is over {0} bytes, oldest chunks of the utterance are dropped".format(self.max_bytes))
+                    self.dropped += 1
+                    self.dropped_sizes.append(len(old) if old is not None else 0)
+
+    def head(self, count):
+        """Returns the stored ones of the first count chunks."""
+        with self.lock:
+            count -= self.dropped
+            spilled = [self.read(self.spill_file, offset, length) for offset, length in list(self.spilled)[:max(count, 0)]]
+            count -= len(spilled)
+            return spilled + list(self.memory)[:max(count, 0)]
+
+    def trim(self, count):
+        """Forgets the first count chunks, returns their size in bytes."""
+        with self.lock:
+            dropped = min(count, self.dropped)
+            size = sum(self.dropped_sizes.popleft() for _ in range(dropped))
+            self.dropped -= dropped
+            count -= dropped
+            while count > 0 and self.spilled:
+                length = self.spilled.popleft()[1]
+                size += length or 0
+                count -= 1
+            if not self.spilled and self.spill_file is not None:
+                # readers still iterating keep the old file alive, new spills go to a new one
+                self.spill_file = None
+                self.spill_size = 0
+            while count > 0 and self.memory:
+                old = self.memory.popleft()
+                self.memory_bytes -= len(old) if old is not None else 0
+                size += len(old) if old is not None else 0
+                count -= 1
+            return size
+
+    def write(self, chunk):
+        if chunk is None:
+            return (self.spill_size, None)
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.spill_dir)
+        offset = self.spill_size
+        self.spill_file.seek(offset)
+        self.spill_file.write(chunk)
+        self.spill_size += len(chunk)
+        return (offset, len(chunk))
+
+    def read(self, spill_file, offset, length):
+        if length is None:
+            return None
+        with self.lock:
+            spill_file.seek(offset)
+            return spill_file.read(length)
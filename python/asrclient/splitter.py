@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Saving recognized utterances as separate sound files.
+
+UtteranceSplitter.add_utterance() takes the same arguments as advanced_utterance_callback
+of a callback module, see advanced_callback_splitter.py for such a module.
+"""
+
+import atexit
+import io
+import logging
+import os
+import sys
+import threading
+
+if sys.version_info >= (3, 0):
+    from .client import bytes_in_sec, find_wav_data, DEFAULT_FORMAT_VALUE
+    from .ttsclient import WavWriter
+    import queue
+else:
+    from client import bytes_in_sec, find_wav_data, DEFAULT_FORMAT_VALUE
+    from ttsclient import WavWriter
+    import Queue as queue
+
+DEFAULT_QUEUE_SIZE = 16
+
+
+class UtteranceSplitter(object):
+    """Cuts utterances out of the recognized audio by align_info and writes them as wav + txt pairs.
+
+    Audio comes in the data_chunks of consecutive utterances, it's kept only from the end of
+    the last cut utterance, so every byte is copied once. Files are written by a background
+    thread, at most queue_size utterances wait for it before add_utterance() blocks.
+    Pending files are flushed on close() or at exit.
+    """
+
+    def __init__(self, directory='.', format=DEFAULT_FORMAT_VALUE, queue_size=DEFAULT_QUEUE_SIZE):
+        self.directory = directory
+        self.bytes_in_sec = bytes_in_sec(format)
+        self.logger = logging.getLogger('asrclient')
+        # audio from stream offset buffer_start on
+        self.buffer = bytearray()
+        self.buffer_start = 0
+        self.received = 0
+        self.count = 0
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.write_files)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def offset(self, seconds):
+        # whole samples only
+        return int(seconds * self.bytes_in_sec) & ~1
+
+    def add_chunks(self, data_chunks):
+        for chunk in data_chunks:
+            if chunk is None:
+                continue
+            self.buffer.extend(chunk)
+            self.received += len(chunk)
+
+    def add_utterance(self, response, data_chunks, path=None, correction=0):
+        """Takes the audio of the utterance from data_chunks and queues it for writing to path.wav and path.txt.
+
+        path is directory/<utterance number> by default. correction is added to align_info times, which
+        start from 0 again in a session resumed after a reconnect. Utterances with nothing recognized
+        or no audio aren't saved.
+        """
+        self.add_chunks(data_chunks)
+        if not response.recognition:
+            return
+        recognition = response.recognition[0]
+        if recognition.words:
+            start, end = recognition.words[0].align_info.start_time, recognition.words[-1].align_info.end_time
+        else:
+            start, end = recognition.align_info.start_time, recognition.align_info.end_time
+        left = min(max(self.offset(start + correction), self.buffer_start), self.received)
+        right = min(max(self.offset(end + correction), left), self.received)
+
+        skip = find_wav_data(self.buffer) if left == 0 else 0
+        audio = memoryview(self.buffer)[left - self.buffer_start + skip:right - self.buffer_start].tobytes()
+        del self.buffer[:right - self.buffer_start]
+        self.buffer_start = right
+        if not audio:
+            return
+
+        if path is None:
+            path = os.path.join(self.directory, str(self.count))
+        self.count += 1
+        self.queue.put((path, audio, recognition.normalized))
+
+    def write_files(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                path, audio, text = item
+                directory = os.path.dirname(path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                with WavWriter(open(path + '.wav', 'wb'), self.bytes_in_sec // 2) as wav:
+                    wav.write(audio)
+                with io.open(path + '.txt', 'w', encoding='utf-8') as txt:
+                    txt.write(text)
+            except Exception as e:
+                self.logger.warning("Can't save utterance: {0}".format(e))
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """Blocks until every queued utterance is written."""
+        self.queue.join()
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
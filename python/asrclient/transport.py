@@ -4,6 +4,173 @@ import sys
 import time
 import ssl
 import pprint
+import threading
+import random
+import errno
+import os
+
+
+# Size of the reusable receive buffer. Every socket read fills it in one
+# recv_into() call, frames are then parsed out of the accumulated bytes.
+RECV_BUFFER_SIZE = 64 * 1024
+
+# Hex length prefix of a frame never gets anywhere close to this.
+MAX_FRAME_HEADER_SIZE = 32
+
+# Connection retries, see Transport.__init__.
+CONNECT_ATTEMPTS = 5
+CONNECT_BACKOFF = 0.5
+CONNECT_MAX_BACKOFF = 8.0
+CONNECT_DEADLINE = 30.0
+
+# Happy eyeballs (RFC 8305): the next address is tried if the current one doesn't connect within this.
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+DNS_CACHE_TTL = 60.0
+
+# A server failing certificate verification fails it on every try, these aren't retried.
+CERTIFICATE_ERRORS = (getattr(ssl, 'SSLCertVerificationError', ssl.CertificateError), ssl.CertificateError)
+
+CONNECT_IN_PROGRESS = (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, getattr(errno, 'WSAEWOULDBLOCK', errno.EWOULDBLOCK))
+
+# Limits for the HTTP response to an upgrade request.
+MAX_UPGRADE_RESPONSE_SIZE = 4096
+UPGRADE_TIMEOUT = 10.0
+
+
+sslLock = threading.Lock()
+sharedSslContext = None
+# (host, port) -> ssl.SSLSession of the last connection, resumed by the next one
+sslSessions = {}
+
+
+def getSslContext():
+    """SSLContext used by connections which aren't given one, verifying certificates by default."""
+    global sharedSslContext
+    with sslLock:
+        if sharedSslContext is None:
+            sharedSslContext = ssl.create_default_context()
+        return sharedSslContext
+
+
+def setSslContext(context):
+    """Replaces the shared SSLContext, e.g. with one trusting a private CA. Cached TLS sessions are dropped."""
+    global sharedSslContext
+    with sslLock:
+        sharedSslContext = context
+        sslSessions.clear()
+
+
+dnsLock = threading.Lock()
+# (host, port, ipv4) -> (expiration time, addresses)
+dnsCache = {}
+
+
+def resolve(host, port, ipv4=False):
+    """Returns getaddrinfo() results for host, cached for DNS_CACHE_TTL seconds.
+
+    Addresses are interleaved by family, starting with the one preferred by the system.
+    """
+    key = (host, port, ipv4)
+    now = time.time()
+    with dnsLock:
+        cached = dnsCache.get(key)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    infos = socket.getaddrinfo(host, port, socket.AF_INET if ipv4 else socket.AF_UNSPEC, socket.SOCK_STREAM)
+    families = []
+    for info in infos:
+        if info[0] not in families:
+            families.append(info[0])
+    byFamily = [[info for info in infos if info[0] == family] for family in families]
+    addresses = []
+    while any(byFamily):
+        for infos in byFamily:
+            if infos:
+                addresses.append(infos.pop(0))
+    with dnsLock:
+        dnsCache[key] = (now + DNS_CACHE_TTL, addresses)
+    return addresses
+
+
+def forgetAddress(host, port, ipv4=False):
+    with dnsLock:
+        dnsCache.pop((host, port, ipv4), None)
+
+
+def setNoDelay(sock):
+    """Turns Nagle's algorithm off, small frames sent in a row would wait for delayed ACKs otherwise."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except (OSError, socket.error):
+        # not a TCP socket
+        pass
+
+
+def connectFirst(addresses, timeout, delay=CONNECTION_ATTEMPT_DELAY):
+    """Returns a blocking socket connected to the first of addresses to answer.
+
+    A connection attempt is started every delay seconds (or right away when the previous one
+    fails) while the earlier ones are still in progress. Raises the last error if none connects,
+    socket.timeout if nothing connects within timeout seconds.
+    """
+    finish_at = time.time() + timeout
+    pending = []
+    error = None
+    index = 0
+    next_at = time.time()
+    try:
+        while True:
+            now = time.time()
+            if index < len(addresses) and (now >= next_at or not pending):
+                family, socktype, proto, _, address = addresses[index]
+                index += 1
+                sock = socket.socket(family, socktype, proto)
+                sock.setblocking(False)
+                code = sock.connect_ex(address)
+                if code == 0:
+                    sock.setblocking(True)
+                    return sock
+                if code in CONNECT_IN_PROGRESS:
+                    pending.append(sock)
+                    next_at = now + delay
+                else:
+                    error = socket.error(code, os.strerror(code))
+                    sock.close()
+                continue
+            if not pending:
+                raise error if error is not None else socket.error('No addresses to connect to')
+            if now >= finish_at:
+                raise socket.timeout('Connection timed out')
+            wait = finish_at - now
+            if index < len(addresses):
+                wait = min(wait, next_at - now)
+            _, writable, _ = select.select([], pending, [], max(wait, 0))
+            for sock in writable:
+                pending.remove(sock)
+                code = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if code == 0:
+                    sock.setblocking(True)
+                    return sock
+                error = socket.error(code, os.strerror(code))
+                sock.close()
+    finally:
+        for sock in pending:
+            sock.close()
+
+
+def encodeVarint(value):
+    """Protobuf base 128 varint encoding of a non negative integer."""
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def frameHeader(size):
+    return hex(size)[2:].encode("utf-8") + b'\r\n'
 
 
 class TransportError(RuntimeError):
@@ -11,33 +178,90 @@ class TransportError(RuntimeError):
         RuntimeError.__init__(self, message)
 
 
-class Transport:
-    def __init__(self, ip, port, timeout=8, verbose=True, enable_ssl=False, ipv4=False, max_faults=0):
+class Transport(object):
+    def __init__(self, ip, port, timeout=8, verbose=True, enable_ssl=False, ipv4=False, max_faults=0, ssl_context=None,
+                 attempts=CONNECT_ATTEMPTS, backoff=CONNECT_BACKOFF, max_backoff=CONNECT_MAX_BACKOFF, deadline=CONNECT_DEADLINE):
+        """Connects to ip:port, making up to attempts tries within deadline seconds overall.
+
+        Tries are separated by exponential backoff with full jitter: a random delay up to backoff
+        before the first retry and twice as long before every next one, but not more than max_backoff,
+        so many clients losing a server at once don't come back in lockstep. Certificate errors
+        are raised without retrying. timeout applies to socket operations after connecting.
+        """
         self.verbose = verbose
         self.max_faults = max_faults
-        tries = 5
-        while tries > 0:
+        self.address = (ip, port)
+        self.initBuffers()
+        finish_at = time.time() + deadline
+        attempt = 0
+        while True:
             try:
                 if self.verbose:
                     print('Trying to connect %s:%s' % (ip, port))
-                    print("Tries left: %s" % (tries,))
+                    print("Tries left: %s" % (attempts - attempt,))
+                remaining = finish_at - time.time()
+                sock = connectFirst(resolve(ip, port, ipv4), min(remaining, timeout or remaining))
+                setNoDelay(sock)
                 if enable_ssl:
-                    s = socket.socket(socket.AF_INET if ipv4 else socket.AF_INET6, socket.SOCK_STREAM)
-                    ssl_sock = ssl.wrap_socket(s)
-                    ssl_sock.connect((ip, port))
-                    print(repr(ssl_sock.getpeername()))
-                    print(ssl_sock.cipher())
-                    print(pprint.pformat(ssl_sock.getpeercert()))
-                    self.socket = ssl_sock
-                else:
-                    self.socket = socket.create_connection((ip, port), timeout)
-                    self.socket.settimeout(timeout)
+                    # the handshake is bounded by the deadline too
+                    sock.settimeout(max(finish_at - time.time(), 0.001))
+                    sock = self.wrapSsl(sock, ssl_context or getSslContext())
+                    if self.verbose:
+                        print(repr(sock.getpeername()))
+                        print(sock.cipher())
+                        print("TLS session reused: %s" % (getattr(sock, 'session_reused', False),))
+                        print(pprint.pformat(sock.getpeercert()))
+                sock.settimeout(timeout)
+                self.socket = sock
                 return None
+            except CERTIFICATE_ERRORS:
+                raise
             except Exception as ex:
-                tries -= 1
-                time.sleep(1)
-                if (tries == 0):
+                delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+                attempt += 1
+                forgetAddress(ip, port, ipv4)
+                if attempt >= attempts or time.time() + delay >= finish_at:
                     raise ex
+                time.sleep(delay)
+
+    def wrapSsl(self, sock, context):
+        """Wraps sock, resuming the TLS session of the last connection to the same address if there is one."""
+        # sessions can be passed in since Python 3.6 only
+        if not hasattr(ssl, 'SSLSession'):
+            return context.wrap_socket(sock, server_hostname=self.address[0])
+        with sslLock:
+            session = sslSessions.get(self.address)
+        try:
+            return context.wrap_socket(sock, server_hostname=self.address[0], session=session)
+        except CERTIFICATE_ERRORS:
+            # a ValueError too, but the handshake did fail
+            raise
+        except ValueError:
+            # the session belongs to another context
+            return context.wrap_socket(sock, server_hostname=self.address[0])
+
+    def saveSslSession(self):
+        session = getattr(self.socket, 'session', None)
+        if session is not None:
+            with sslLock:
+                sslSessions[self.address] = session
+
+    @classmethod
+    def fromSocket(cls, sock, verbose=False, max_faults=0):
+        """Wraps an already connected socket, e.g. an accepted one."""
+        t = cls.__new__(cls)
+        t.verbose = verbose
+        t.max_faults = max_faults
+        t.address = None
+        t.socket = sock
+        t.initBuffers()
+        return t
+
+    def initBuffers(self):
+        self.recvBuffer = bytearray(RECV_BUFFER_SIZE)
+        self.recvView = memoryview(self.recvBuffer)
+        # received from the socket but not consumed yet
+        self.received = bytearray()
 
     def __enter__(self):
         return self
@@ -72,24 +296,49 @@ class Transport:
             print("Send " + str(len(data)))
 
     def recv(self, length, decode=(sys.version_info[0] == 3)):
-        res = b""
         faults = 0
-        while True:
+        while len(self.received) < length:
             try:
-                res += self.socket.recv(length - len(res))
-                if len(res) < length:
-                    rlist, _, xlist = select.select([self.socket], [], [self.socket], 0.1)
-                else:
-                    if decode:
-                        return res.decode("utf-8")
-                    else:
-                        return res
+                self.fill()
+            except TransportError:
+                raise
             except Exception as e:
                 if self.verbose:
                     print("Exception on recv: ", e)
                 faults += 1
                 if faults > self.max_faults:
                     raise e
+        res = self.consume(length)
+        if decode:
+            return res.decode("utf-8")
+        else:
+            return res
+
+    def fill(self):
+        """Reads whatever is available from the socket into the receive buffer."""
+        size = self.socket.recv_into(self.recvBuffer)
+        if size == 0:
+            raise TransportError('Backend closed connection')
+        self.received += self.recvView[:size]
+        return size
+
+    def consume(self, length):
+        res = bytes(self.received[:length])
+        del self.received[:length]
+        return res
+
+    def readable(self, timeout=0):
+        if self.received:
+            return True
+        return self.socketReadable(timeout)
+
+    def socketReadable(self, timeout=0):
+        """Whether the socket itself has something to read, regardless of the receive buffer."""
+        # ssl socket can hold already decrypted data that select() doesn't see
+        if getattr(self.socket, 'pending', None) is not None and self.socket.pending() > 0:
+            return True
+        rlist, wlist, xlist = select.select([self.socket], [], [self.socket], timeout)
+        return len(rlist) > 0
 
     def sendFull(self, message):
         begin = 0
@@ -97,38 +346,88 @@ class Transport:
             begin += self.socket.send(message[begin:])
 
     def sendMessage(self, message):
-        self.socket.send(hex(len(message))[2:].encode("utf-8"))
-        self.socket.send(b'\r\n')
-        self.sendFull(message)
+        self.sendMessageParts([message])
+
+    def sendMessageParts(self, parts):
+        """Sends a frame of parts (bytes or memoryviews) concatenated, without concatenating them in memory.
+
+        The whole frame goes out in one sendmsg() call where possible, separate small writes
+        of the header and the body would wait for delayed ACKs because of Nagle's algorithm.
+        """
+        size = sum(len(part) for part in parts)
+        parts = [frameHeader(size)] + list(parts)
+        if hasattr(self.socket, 'sendmsg') and not isinstance(self.socket, ssl.SSLSocket):
+            views = [memoryview(part) for part in parts]
+            while views:
+                sent = self.socket.sendmsg(views)
+                while views and sent >= len(views[0]):
+                    sent -= len(views[0])
+                    views.pop(0)
+                if sent:
+                    views[0] = views[0][sent:]
+        else:
+            self.socket.sendall(b''.join(parts))
         if self.verbose:
-            print("Send message size: ", len(message))
+            print("Send message size: ", size)
 
-    def recvMessage(self):
-        size = b''
+    def recvUntil(self, delimiter, limit):
+        """Receives everything up to and including delimiter, None if it doesn't come within limit bytes."""
         while True:
-            symbol = self.socket.recv(1)
+            end = self.received.find(delimiter)
+            if end >= 0:
+                return self.consume(end + len(delimiter))
+            if len(self.received) > limit:
+                return None
+            self.fill()
 
-            if len(symbol) == 0:
-                raise TransportError('Backend closed connection')
+    def upgrade(self, request, timeout=UPGRADE_TIMEOUT):
+        """Sends an HTTP upgrade request and returns the response headers, None if they are too long.
 
-            assert(len(symbol) == 1), 'Bad symbol len from socket ' + str(len(symbol))
+        The response is read in bulk, whatever follows the headers stays buffered for recvMessage().
+        Raises TransportError if the headers don't arrive within timeout seconds.
+        """
+        self.send(request)
+        deadline = time.time() + timeout
+        while True:
+            end = self.received.find(b'\r\n\r\n')
+            if end >= 0:
+                return self.consume(end + 4)
+            if len(self.received) > MAX_UPGRADE_RESPONSE_SIZE:
+                return None
+            remaining = deadline - time.time()
+            # partial headers may be buffered already, so it's the socket which is waited for
+            if remaining <= 0 or not self.socketReadable(remaining):
+                raise TransportError('No response to upgrade request in {0} seconds'.format(timeout))
+            self.fill()
 
-            if symbol == b'\r':
-                self.socket.recv(1)
-                break
-            else:
-                size += symbol
-        sizeInt = int(b'0x' + size, 0)
+    def recvMessage(self):
+        size = self.recvUntil(b'\r\n', MAX_FRAME_HEADER_SIZE)
+        if size is None:
+            raise TransportError('Bad message header from socket ' + repr(bytes(self.received[:MAX_FRAME_HEADER_SIZE])))
+
+        sizeInt = int(size, 16)
         if self.verbose:
             print("Got message. Expecting {0} bytes length.".format(sizeInt))
         if (sizeInt > 0):
-            result = b''
-            while len(result) < sizeInt:
-                result += self.socket.recv(sizeInt - len(result), False)
-            result = result
-            assert (len(result) == sizeInt), 'Invalid message size'
-            return result
-        return ''
+            return self.recvExactly(sizeInt)
+        return b''
+
+    def recvExactly(self, size):
+        if len(self.received) >= size:
+            return self.consume(size)
+
+        # large body: receive straight into its final place
+        result = bytearray(size)
+        view = memoryview(result)
+        offset = len(self.received)
+        view[:offset] = self.received
+        del self.received[:]
+        while offset < size:
+            got = self.socket.recv_into(view[offset:])
+            if got == 0:
+                raise TransportError('Backend closed connection')
+            offset += got
+        return bytes(result)
 
     def sendProtobuf(self, protobuf):
         self.sendMessage(protobuf.SerializeToString())
@@ -148,8 +447,10 @@ class Transport:
         raise savedException
 
     def recvProtobufIfAny(self, *protobuf):
-        rlist, wlist, xlist = select.select([self.socket], [], [self.socket], 0)
-        if (len(rlist)):
+        return self.recvProtobufWithin(0, *protobuf)
+
+    def recvProtobufWithin(self, timeout, *protobuf):
+        if self.readable(timeout):
             return self.recvProtobuf(*protobuf)
         else:
             return None
@@ -161,6 +462,9 @@ class Transport:
     def close(self):
         if self.verbose:
             print('Close socket' + str(self.socket))
+        if self.address is not None and isinstance(self.socket, ssl.SSLSocket):
+            # TLS 1.3 tickets arrive after the handshake, so the session is saved when it's done
+            self.saveSslSession()
         self.socket.close()
 
     def __exit__(self, type, value, traceback):
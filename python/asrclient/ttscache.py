@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Cache of synthesized audio for prompts which are requested over and over."""
+
+import collections
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 32 * 1024 * 1024
+BLOCK_SIZE = 64 * 1024
+
+SUFFIX = '.audio'
+
+replace = getattr(os, 'replace', os.rename)
+
+
+class TtsCache(object):
+    """Synthesized audio keyed by a hash of the whole GenerateRequest.
+
+    Entries are stored in directory (memory only if it's None), the most recently used ones
+    up to memory_bytes are kept in memory too. Disk usage is kept under max_bytes by evicting
+    least recently used entries, entries older than ttl seconds are treated as missing.
+    Files are written under temporary names and renamed when complete, so readers never see
+    partial audio and several processes may share the directory.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES, memory_bytes=DEFAULT_MEMORY_BYTES, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (audio, created), least recently used first
+        self.memory = collections.OrderedDict()
+        self.memory_size = 0
+        # key -> (size, created), least recently used first
+        self.disk = collections.OrderedDict()
+        self.disk_size = 0
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.scan()
+
+    @staticmethod
+    def key(request):
+        return hashlib.sha256(request.SerializeToString(deterministic=True)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def scan(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, name[:-len(SUFFIX)], st.st_size))
+        for created, key, size in sorted(entries):
+            self.disk[key] = (size, created)
+            self.disk_size += size
+
+    def expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """Returns an iterator over blocks of cached audio, None if there is no such entry."""
+        with self.lock:
+            entry = self.memory.pop(key, None)
+            if entry is not None and not self.expired(entry[1]):
+                self.memory[key] = entry
+                return iter([entry[0]])
+            if entry is not None:
+                self.memory_size -= len(entry[0])
+            if self.directory is None:
+                return None
+
+            entry = self.disk.pop(key, None)
+            if entry is None:
+                # might be written by another process
+                try:
+                    st = os.stat(self.path(key))
+                    entry = (st.st_size, st.st_mtime)
+                    self.disk_size += st.st_size
+                except OSError:
+                    return None
+            if self.expired(entry[1]):
+                self.disk_size -= entry[0]
+                self.remove(key)
+                return None
+            self.disk[key] = entry
+
+        try:
+            f = open(self.path(key), 'rb')
+        except (IOError, OSError):
+            with self.lock:
+                if self.disk.pop(key, None) is not None:
+                    self.disk_size -= entry[0]
+            return None
+        return self.read(f)
+
+    def read(self, f):
+        with f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def put(self, key, audio):
+        writer = self.writer(key)
+        writer.write(audio)
+        writer.commit()
+
+    def add(self, key, audio, temporary, size):
+        created = time.time()
+        with self.lock:
+            if audio is not None and len(audio) <= self.memory_bytes:
+                old = self.memory.pop(key, None)
+                if old is not None:
+                    self.memory_size -= len(old[0])
+                self.memory[key] = (audio, created)
+                self.memory_size += len(audio)
+                while self.memory_size > self.memory_bytes:
+                    self.memory_size -= len(self.memory.popitem(last=False)[1][0])
+            if temporary is not None:
+                replace(temporary, self.path(key))
+                old = self.disk.pop(key, None)
+                if old is not None:
+                    self.disk_size -= old[0]
+                self.disk[key] = (size, created)
+                self.disk_size += size
+                while self.disk_size > self.max_bytes and len(self.disk) > 1:
+                    old_key, (old_size, _) = self.disk.popitem(last=False)
+                    self.disk_size -= old_size
+                    self.remove(old_key)
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_size = 0
+            for key in list(self.disk):
+                self.remove(key)
+            self.disk.clear()
+            self.disk_size = 0
+
+
+class CacheWriter(object):
+    """Collects audio of an entry, the entry shows up in the cache only on commit()."""
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.size = 0
+        # audio is kept in memory while it fits in the memory part of the cache
+        self.blocks = []
+        self.file = None
+        self.temporary = None
+        if cache.directory is not None:
+            fd, self.temporary = tempfile.mkstemp(dir=cache.directory, suffix='.tmp')
+            self.file = os.fdopen(fd, 'wb')
+
+    def write(self, audio):
+        self.size += len(audio)
+        if self.blocks is not None:
+            self.blocks.append(audio)
+            if self.size > self.cache.memory_bytes:
+                self.blocks = None
+        if self.file is not None:
+            self.file.write(audio)
+
+    def commit(self):
+        if self.file is not None:
+            self.file.close()
+        self.cache.add(self.key, b''.join(self.blocks) if self.blocks is not None else None, self.temporary, self.size)
+
+    def abort(self):
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.temporary)
@@ -2,24 +2,36 @@
 # -*- coding: utf-8 -*-
 
 import sys, os
-import requests
 from datetime import datetime
 import time
 import random
 import logging
+import collections
+import json
+import re
+import struct
+import tempfile
+
+import threading
+from socket import error as SocketError
 
 if sys.version_info >= (3, 0):
-    from .transport import Transport
+    from .transport import Transport, TransportError
     from .basic_pb2 import ConnectionResponse
-    from .ttsbackend_pb2 import Generate, GenerateResponse
+    from .ttsbackend_pb2 import Generate, GenerateResponse, StopGeneration
     from .tts_pb2 import GenerateRequest, ConnectionRequest, ParamsRequest, ParamsResponse
+    from .ttscache import TtsCache
+    import queue
 else:
-    from transport import Transport
+    from transport import Transport, TransportError
     from basic_pb2 import ConnectionResponse
-    from ttsbackend_pb2 import Generate, GenerateResponse
+    from ttsbackend_pb2 import Generate, GenerateResponse, StopGeneration
     from tts_pb2 import GenerateRequest, ConnectionRequest, ParamsRequest, ParamsResponse
+    from ttscache import TtsCache
+    import Queue as queue
 
 from uuid import uuid4 as randomUuid
+from google.protobuf import json_format
 
 DEFAULT_KEY_VALUE = 'paste-your-own-key'
 DEFAULT_SERVER_VALUE = 'tts.voicetech.yandex.net'
@@ -32,58 +44,109 @@ DEFAULT_UUID_VALUE = randomUuid().hex
 DEFAULT_FORMAT_VALUE = 'wav'
 DEFAULT_QUALITY_VALUE = 'high'
 
+DEFAULT_POOL_SIZE = 4
+DEFAULT_VOICES_TTL = 3600
+DEFAULT_PIECE_LENGTH = 400
+
+SENTENCE_END = re.compile(u'(?<=[.!?;\u2026])\\s+', re.UNICODE)
+
+UPGRADE_REQUEST = ("GET /ytcp2 HTTP/1.1\r\n" +
+                   "User-Agent:KeepAliveClient\r\n" +
+                   "Host: {0}:{1}\r\n" +
+                   "Upgrade: websocket\r\n\r\n")
+
+SAMPLE_RATES = {'ultra': 48000,
+                'high': 16000,
+                'low': 8000}
+
+# One piece of synthesized audio; words and phonemes are filled only when metainfo was required.
+SynthesisChunk = collections.namedtuple('SynthesisChunk', ['audio', 'words', 'phonemes'])
+
+
+class TtsError(RuntimeError):
+    def __init__(self, message):
+        RuntimeError.__init__(self, message)
+
+
+class SynthesisError(TtsError):
+    def __init__(self, message):
+        TtsError.__init__(self, message)
+
+WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+# sizes of a stream of unknown length
+WAV_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
 def generateWavHeader(sample_rate, mono=True, data_size=0):
-    gWavHeader = "RIFF\xff\xff\xff\xffWAVEfmt \x10\x00\x00\x00\x01\x00" + ("\x01" if mono else "\x02") + "\x00"
-    wav_rate = ""
-    wav_rate_align = ""
-    sample_rate_align = sample_rate * 2
-    for i in xrange(0, 4):
-        wav_rate += chr(sample_rate % (256 if mono else 512))  # sample_rate * block_align (2 for mono) as int32
-        wav_rate_align += chr(sample_rate_align % 256)  # sample_rate as int32
-        sample_rate /= 256
-        sample_rate_align /= 256
-    gWavHeader += wav_rate
-    gWavHeader += wav_rate_align
-    gWavHeader += "\x02" if mono else "\x04"
-    gWavHeader += "\x00\x10\x00data\xff\xff\xff\xff"
-
-    if data_size > 0:
-        size_of_wav = data_size + 36
-        hexWavSize = ""
-        hexDataSize = ""
-        for i in xrange(0,4):
-            hexWavSize += chr(size_of_wav % 256)
-            size_of_wav /= 256
-            hexDataSize += chr(data_size % 256)
-            data_size /= 256
-        gWavHeader = gWavHeader[:4] + hexWavSize + gWavHeader[8:40] + hexDataSize
-
-    return gWavHeader
+    """Returns 44 bytes of 16 bit PCM wav header, sizes are unknown (0xFFFFFFFF) if data_size is 0."""
+    channels = 1 if mono else 2
+    block_align = channels * 2
+    if 0 < data_size <= WAV_UNKNOWN_SIZE - (WAV_HEADER.size - 8):
+        riff_size = data_size + WAV_HEADER.size - 8
+    else:
+        riff_size = data_size = WAV_UNKNOWN_SIZE
+    return WAV_HEADER.pack(b'RIFF', riff_size, b'WAVE',
+                           b'fmt ', 16, 1, channels, sample_rate, sample_rate * block_align, block_align, 16,
+                           b'data', data_size)
+
+
+class WavWriter(object):
+    """Writes 16 bit PCM audio to file after a wav header.
+
+    The header is written at once with unknown sizes, close() patches it with the real ones
+    if file is seekable, otherwise (a pipe, stdout) it's left a streaming header.
+    """
+
+    def __init__(self, file, sample_rate, mono=True):
+        self.file = file
+        self.sample_rate = sample_rate
+        self.mono = mono
+        self.data_size = 0
+        try:
+            self.start = file.tell()
+        except (IOError, OSError, AttributeError):
+            self.start = None
+        file.write(generateWavHeader(sample_rate, mono))
+
+    def write(self, data):
+        self.file.write(data)
+        self.data_size += len(data)
+
+    def patch(self):
+        if self.start is None or not self.data_size:
+            return
+        try:
+            self.file.seek(self.start)
+            self.file.write(generateWavHeader(self.sample_rate, self.mono, self.data_size))
+            self.file.seek(0, os.SEEK_END)
+        except (IOError, OSError):
+            pass
+
+    def close(self):
+        self.patch()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
 
 def upgradeToProtobuf(transport, server, port):
         transport.verbose = False
-        transport.send("GET /ytcp2 HTTP/1.1\r\n" +
-                "User-Agent:KeepAliveClient\r\n" +
-                "Host: %s:%s\r\n" % (server, port) +
-                "Upgrade: websocket\r\n\r\n");
-        check = "HTTP/1.1 101"
-        checkRecv = ""
-        while True:
-            checkRecv += transport.recv(1)
-            if checkRecv.startswith(check) and checkRecv.endswith("\r\n\r\n"):
-                break
-            if len(checkRecv) > 300:
-                return False
-        return True
-
-def list_speakers(server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, **kwars):
+        response = transport.upgrade(UPGRADE_REQUEST.format(server, port))
+        return response is not None and response.startswith(b"HTTP/1.1 101")
+
+def connect(server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False):
+    """Opens a transport ready for ParamsRequest, raises TtsError if the server refuses."""
     logger = logging.getLogger('asrclient')
-    with Transport(server, port, timeout=None, verbose=False, enable_ssl=(port==443), ipv4=ipv4) as t:
+    t = Transport(server, port, timeout=None, verbose=False, enable_ssl=(port==443), ipv4=ipv4)
+    try:
         if not upgradeToProtobuf(t, server, port):
-            logger.info("Wrong response on upgrade request. Exiting.")
-            sys.exit(1)
+            raise TtsError("Wrong response on upgrade request.")
         logger.info("Upgraded to protobuf, sending connect request.")
-        
+
         t.sendProtobuf(ConnectionRequest(
             serviceName="tts",
             speechkitVersion="ttsclient",
@@ -92,85 +155,456 @@ def list_speakers(server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFA
         ))
 
         connectionResponse = t.recvProtobuf(ConnectionResponse)
-        
+
         if connectionResponse.responseCode != 200:
-            logger.info("Bad response code %s: %s" % (connectionResponse.responseCode, connectionResponse.message))
-            sys.exit(1)
+            raise TtsError("Bad response code %s: %s" % (connectionResponse.responseCode, connectionResponse.message))
+    except Exception:
+        t.close()
+        raise
+    return t
 
-        logger.info("Connected, getting speakers list.")
 
-        t.sendProtobuf(ParamsRequest(
-            listVoices=True
+def make_generate_request(text, speaker, lang=DEFAULT_LANG_VALUE, emotion=None, gender=None, format=DEFAULT_FORMAT_VALUE, quality=DEFAULT_QUALITY_VALUE, require_metainfo=False):
+    request = GenerateRequest(
+        lang=lang,
+        text=text,
+        application="ttsclient",
+        platform="local",
+        voice=speaker,
+        requireMetainfo=require_metainfo,
+        format={'wav': GenerateRequest.Pcm, 'pcm': GenerateRequest.Pcm, 'speex': GenerateRequest.Spx, 'opus': GenerateRequest.Opus}.get(format, GenerateRequest.Pcm),
+        quality=({'low': GenerateRequest.Low, 'high': GenerateRequest.High, 'ultra': GenerateRequest.UltraHigh}[quality]),
+        chunked=True
+    )
+
+    if emotion or gender:
+        request.lowLevelGenerateRequest.CopyFrom(Generate(
+            voices=[Generate.WeightedParam(name=speaker, weight=1.0)],
+            emotions=[Generate.WeightedParam(name=emotion, weight=1.0)] if emotion else [],
+            genders=[Generate.WeightedParam(name=gender, weight=1.0)] if gender else [],
+            lang=lang[:2],
+            text=text,
+            fast=False,
+            requireMetainfo=require_metainfo
         ))
+    return request
+
+
+class VoiceCatalogue(object):
+    """ParamsResponse.voiceList of a server, kept for ttl seconds.
+
+    If path is given, the list is saved there as JSON and loaded back by the next catalogue, so
+    a fresh process doesn't have to ask the server either. The list is refreshed by every
+    ParamsResponse of sessions using the catalogue, get() asks the server only when it's stale.
+    """
 
-        res = t.recvProtobuf(ParamsResponse)
+    def __init__(self, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, path=None, ttl=DEFAULT_VOICES_TTL):
+        self.server = server
+        self.port = port
+        self.key = key
+        self.uuid = uuid
+        self.ipv4 = ipv4
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.voices = None
+        self.updated = 0
+        if path is not None:
+            self.load()
 
-        print(", ".join([v.name for v in res.voiceList if v.coreVoice]))
+    def fresh(self):
+        return self.voices is not None and time.time() - self.updated <= self.ttl
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+            if saved['server'] != '{0}:{1}'.format(self.server, self.port):
+                return
+            self.voices = [json_format.ParseDict(v, ParamsResponse.Voice()) for v in saved['voices']]
+            self.updated = saved['updated']
+        except (IOError, OSError, ValueError, KeyError, json_format.ParseError):
+            pass
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({
+                'server': '{0}:{1}'.format(self.server, self.port),
+                'updated': self.updated,
+                'voices': [json_format.MessageToDict(v) for v in self.voices],
+            }, f)
+        getattr(os, 'replace', os.rename)(temporary, self.path)
+
+    def update(self, voices):
+        with self.lock:
+            self.voices = list(voices)
+            self.updated = time.time()
+            if self.path is not None:
+                try:
+                    self.save()
+                except (IOError, OSError) as e:
+                    logging.getLogger('asrclient').warning("Can't save voice list to %s: %s" % (self.path, e))
+
+    def cached(self):
+        """Returns the list if it's fresh, None otherwise, never asks the server."""
+        with self.lock:
+            return self.voices if self.fresh() else None
+
+    def get(self):
+        """Returns the list, asks the server if it's stale. Raises TtsError if the server refuses."""
+        voices = self.cached()
+        if voices is not None:
+            return voices
+        with connect(self.server, self.port, self.key, self.uuid, self.ipv4) as t:
+            t.sendProtobuf(ParamsRequest(
+                listVoices=True
+            ))
+            self.update(t.recvProtobuf(ParamsResponse).voiceList)
+        return self.voices
 
-def generate(file, text, speaker, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, lang=DEFAULT_LANG_VALUE, emotion=None, gender=None, ipv4=False, format=DEFAULT_FORMAT_VALUE, quality=DEFAULT_QUALITY_VALUE):
+    def names(self):
+        return [v.name for v in self.get() if v.coreVoice]
+
+    def check(self, speaker):
+        """Same as check_speaker() with the cached list, does nothing if there is no fresh one."""
+        check_speaker(speaker, self.cached())
+
+
+def check_speaker(speaker, voices):
+    """Raises SynthesisError if there is no speaker in non empty voices."""
+    if voices and speaker not in [v.name for v in voices]:
+        raise SynthesisError("Unknown speaker %s" % (speaker,))
+
+
+def list_speakers(server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, catalogue=None, **kwars):
     logger = logging.getLogger('asrclient')
-    with Transport(server, port, timeout=None, verbose=False, enable_ssl=(port==443), ipv4=ipv4) as t:
-        if not upgradeToProtobuf(t, server, port):
-            logger.info("Wrong response on upgrade request. Exiting.")
-            sys.exit(1)
-        logger.info("Upgraded to protobuf, sending connect request")
-        
-        t.sendProtobuf(ConnectionRequest(
-            serviceName="tts",
-            speechkitVersion="ttsclient",
-            uuid=uuid,
-            apiKey=key
-        ))
+    if catalogue is None:
+        catalogue = VoiceCatalogue(server, port, key, uuid, ipv4)
+    try:
+        logger.info("Getting speakers list.")
+        names = catalogue.names()
+    except TtsError as e:
+        logger.info("%s Exiting." % (e,))
+        sys.exit(1)
+    print(", ".join(names))
 
-        connectionResponse = t.recvProtobuf(ConnectionResponse)
-        
-        if connectionResponse.responseCode != 200:
-            logger.info("Bad response code %s: %s" % (connectionResponse.responseCode, connectionResponse.message))
-            sys.exit(1)
 
-        t.sendProtobuf(ParamsRequest(
+def cached(cache, request, synthesize):
+    """Yields SynthesisChunk of request from cache, or of synthesize() storing the audio in cache.
+
+    Metainfo isn't cached, requests requiring it always go to the server.
+    """
+    if cache is None or request.requireMetainfo:
+        for chunk in synthesize():
+            yield chunk
+        return
+
+    key = TtsCache.key(request)
+    blocks = cache.get(key)
+    if blocks is not None:
+        logging.getLogger('asrclient').info("Got audio from cache.")
+        for block in blocks:
+            yield SynthesisChunk(block, [], [])
+        return
+
+    writer = cache.writer(key)
+    complete = False
+    try:
+        for chunk in synthesize():
+            writer.write(chunk.audio)
+            yield chunk
+        complete = True
+    finally:
+        if complete:
+            writer.commit()
+        else:
+            writer.abort()
+
+
+def generate_stream(text, speaker, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, lang=DEFAULT_LANG_VALUE, emotion=None, gender=None, ipv4=False, format=DEFAULT_FORMAT_VALUE, quality=DEFAULT_QUALITY_VALUE, require_metainfo=False, cache=None, catalogue=None):
+    """Yields SynthesisChunk as soon as every piece of audio arrives.
+
+    Audio is raw (no wav header) in the requested format. Raises TtsError if the server refuses
+    the connection, SynthesisError if it fails to synthesize the text. With a TtsCache passed as
+    cache, requests synthesized before don't connect at all. With a VoiceCatalogue, unknown
+    speakers are rejected before connecting.
+    """
+    request = make_generate_request(text, speaker, lang, emotion, gender, format, quality, require_metainfo)
+
+    def synthesize():
+        if catalogue is not None:
+            catalogue.check(speaker)
+        with connect(server, port, key, uuid, ipv4) as t:
+            # the proxy requires it before GenerateRequest
+            t.sendProtobuf(ParamsRequest(
+                listVoices=True
+            ))
+
+            params = t.recvProtobuf(ParamsResponse)
+            if catalogue is not None:
+                catalogue.update(params.voiceList)
+            check_speaker(speaker, params.voiceList)
+
+            t.sendProtobuf(request)
+            while True:
+                ttsResponse = t.recvProtobuf(GenerateResponse)
+                if ttsResponse.message:
+                    raise SynthesisError("Error on synthesis: %s" % (ttsResponse.message,))
+
+                if ttsResponse.completed:
+                    break
+                yield SynthesisChunk(ttsResponse.audioData, list(ttsResponse.words), list(ttsResponse.phonemes))
+
+    return cached(cache, request, synthesize)
+
+
+class TtsSession(object):
+    """Connection serving many GenerateRequests one after another.
+
+    Upgrade, ConnectionRequest and ParamsRequest are done once, the voice list got on the way
+    is kept in voices (and passed to catalogue if any). Unknown speakers are rejected without
+    a request. If the server has closed the connection since the last request, the session
+    reconnects and sends the request again. A session serves one request at a time.
+    """
+
+    def __init__(self, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, catalogue=None):
+        self.server = server
+        self.port = port
+        self.key = key
+        self.uuid = uuid
+        self.ipv4 = ipv4
+        self.catalogue = catalogue
+        self.t = None
+        self.voices = []
+        self.open()
+
+    def open(self):
+        self.t = connect(self.server, self.port, self.key, self.uuid, self.ipv4)
+        self.t.sendProtobuf(ParamsRequest(
             listVoices=True
         ))
+        self.voices = list(self.t.recvProtobuf(ParamsResponse).voiceList)
+        if self.catalogue is not None:
+            self.catalogue.update(self.voices)
 
-        res = t.recvProtobuf(ParamsResponse)
+    def close(self):
+        if self.t is not None:
+            self.t.close()
+            self.t = None
 
-        request = GenerateRequest(
-            lang=lang,
-            text=text,
-            application="ttsclient",
-            platform="local",
-            voice=speaker,
-            requireMetainfo=False,
-            format={'wav': GenerateRequest.Pcm, 'pcm': GenerateRequest.Pcm, 'speex': GenerateRequest.Spx, 'opus': GenerateRequest.Opus}.get(format, GenerateRequest.Pcm),
-            quality=({'low': GenerateRequest.Low, 'high': GenerateRequest.High, 'ultra': GenerateRequest.UltraHigh}[quality]),
-            chunked=True
-        )
-
-        if emotion or gender:
-            request.lowLevelGenerateRequest.CopyFrom(Generate(
-                voices=[Generate.WeightedParam(name=speaker, weight=1.0)],
-                emotions=[Generate.WeightedParam(name=emotion, weight=1.0)] if emotion else [],
-                genders=[Generate.WeightedParam(name=gender, weight=1.0)] if gender else [],
-                lang=lang[:2],
-                text=text,
-                fast=False,
-                requireMetainfo=False
-            ))
-        
-        t.sendProtobuf(request)
-        if format == 'wav':
-            file.write(generateWavHeader({'ultra': 48000,
-                                            'high': 16000,
-                                            'low': 8000}[quality]))
-        while True:
-            ttsResponse = t.recvProtobuf(GenerateResponse)
-            if ttsResponse.message:
-                logger.info("Error on synthesis: %s" % (ttsResponse.message,))
-                sys.exit(2)
-            
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def start(self, request):
+        """Sends request and returns the first response, reconnecting once if the connection is gone."""
+        for attempt in range(2):
+            try:
+                if self.t is None:
+                    self.open()
+                self.t.sendProtobuf(request)
+                return self.t.recvProtobuf(GenerateResponse)
+            except (TransportError, SocketError):
+                self.close()
+                if attempt:
+                    raise
+
+    def stop(self):
+        """Asks the server to stop current generation, the generator finishes after the audio already sent."""
+        self.t.sendProtobuf(StopGeneration())
+
+    def generate(self, text, speaker, lang=DEFAULT_LANG_VALUE, emotion=None, gender=None, format=DEFAULT_FORMAT_VALUE, quality=DEFAULT_QUALITY_VALUE, require_metainfo=False, cache=None):
+        """Same as generate_stream() over this session's connection."""
+        request = make_generate_request(text, speaker, lang, emotion, gender, format, quality, require_metainfo)
+        return cached(cache, request, lambda: self.synthesize(request))
+
+    def synthesize(self, request):
+        voices = self.catalogue.cached() if self.catalogue is not None else None
+        check_speaker(request.voice, voices or self.voices)
+        ttsResponse = self.start(request)
+        try:
+            while True:
+                if ttsResponse.message:
+                    raise SynthesisError("Error on synthesis: %s" % (ttsResponse.message,))
+
+                if ttsResponse.completed:
+                    break
+                yield SynthesisChunk(ttsResponse.audioData, list(ttsResponse.words), list(ttsResponse.phonemes))
+                ttsResponse = self.t.recvProtobuf(GenerateResponse)
+        finally:
             if not ttsResponse.completed:
-                file.write(ttsResponse.audioData)
-            else:
-                file.close()
-                break
+                # abandoned in the middle, the rest of the audio is dropped
+                self.discard()
+
+    def discard(self):
+        try:
+            self.stop()
+            while not self.t.recvProtobuf(GenerateResponse).completed:
+                pass
+        except Exception:
+            self.close()
+
+
+class TtsSessionPool(object):
+    """Up to size TtsSessions shared by concurrent callers, opened on demand."""
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, catalogue=None):
+        self.size = size
+        self.connection_args = (server, port, key, uuid, ipv4, catalogue)
+        # notified when a session is released or a place to open one frees up
+        self.lock = threading.Condition()
+        self.opened = 0
+        self.idle = collections.deque()
+
+    def acquire(self):
+        with self.lock:
+            while not self.idle and self.opened >= self.size:
+                self.lock.wait()
+            if self.idle:
+                return self.idle.popleft()
+            self.opened += 1
+        try:
+            return TtsSession(*self.connection_args)
+        except Exception:
+            # a waiting caller may try to open one itself
+            with self.lock:
+                self.opened -= 1
+                self.lock.notify()
+            raise
+
+    def release(self, session):
+        with self.lock:
+            self.idle.append(session)
+            self.lock.notify()
+
+    def generate(self, text, speaker, **kwargs):
+        """Same as TtsSession.generate() on the first free session."""
+        session = self.acquire()
+        try:
+            for chunk in session.generate(text, speaker, **kwargs):
+                yield chunk
+        finally:
+            self.release(session)
+
+    def close(self):
+        with self.lock:
+            sessions = list(self.idle)
+            self.idle.clear()
+        for session in sessions:
+            session.close()
+
+
+def split_sentences(text, max_length=DEFAULT_PIECE_LENGTH):
+    """Splits text into pieces of whole sentences up to max_length characters.
+
+    Sentences longer than max_length are split at spaces.
+    """
+    pieces = []
+    piece = u""
+    for sentence in SENTENCE_END.split(text.strip()):
+        while len(sentence) > max_length:
+            cut = sentence.rfind(u" ", 0, max_length + 1)
+            if cut <= 0:
+                cut = max_length
+            if piece:
+                pieces.append(piece)
+                piece = u""
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if not sentence:
+            continue
+        if piece and len(piece) + 1 + len(sentence) > max_length:
+            pieces.append(piece)
+            piece = u""
+        piece = piece + u" " + sentence if piece else sentence
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+def generate_long(text, speaker, pool=None, concurrency=DEFAULT_POOL_SIZE, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, ipv4=False, catalogue=None, max_length=DEFAULT_PIECE_LENGTH, **kwargs):
+    """Same as generate_stream() for long texts: sentences are synthesized by concurrency sessions at once.
+
+    Text is split with split_sentences(), audio of the pieces is yielded in text order as soon
+    as it's the turn of its piece. At most twice concurrency pieces are synthesized ahead of the one
+    being yielded. Sessions are taken from pool if given, otherwise a pool is opened and closed here.
+    Other keyword arguments are passed to TtsSession.generate().
+    """
+    pieces = split_sentences(text, max_length)
+    own_pool = pool is None
+    if own_pool:
+        pool = TtsSessionPool(concurrency, server, port, key, uuid, ipv4, catalogue)
+    outputs = [queue.Queue() for _ in pieces]
+    tasks = queue.Queue()
+    for i in range(len(pieces)):
+        tasks.put(i)
+    window = threading.Semaphore(2 * concurrency)
+    stopped = threading.Event()
+
+    def work():
+        while True:
+            # a slot is taken before a piece, so the pieces holding slots are always the next ones to yield
+            window.acquire()
+            if stopped.is_set():
+                return
+            try:
+                i = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                for chunk in pool.generate(pieces[i], speaker, **kwargs):
+                    if stopped.is_set():
+                        break
+                    outputs[i].put(chunk)
+                outputs[i].put(None)
+            except Exception as e:
+                outputs[i].put(e)
+
+    workers = [threading.Thread(target=work) for _ in range(min(concurrency, len(pieces)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        for output in outputs:
+            while True:
+                chunk = output.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+            window.release()
+    finally:
+        stopped.set()
+        for worker in workers:
+            window.release()
+        for worker in workers:
+            worker.join()
+        if own_pool:
+            pool.close()
+
+
+def generate(file, text, speaker, server=DEFAULT_SERVER_VALUE, port=DEFAULT_PORT_VALUE, key=DEFAULT_KEY_VALUE, uuid=DEFAULT_UUID_VALUE, lang=DEFAULT_LANG_VALUE, emotion=None, gender=None, ipv4=False, format=DEFAULT_FORMAT_VALUE, quality=DEFAULT_QUALITY_VALUE, cache=None, catalogue=None, split=False, concurrency=DEFAULT_POOL_SIZE):
+    logger = logging.getLogger('asrclient')
+    try:
+        if split:
+            chunks = generate_long(text, speaker, concurrency=concurrency, server=server, port=port, key=key, uuid=uuid, ipv4=ipv4,
+                                   catalogue=catalogue, lang=lang, emotion=emotion, gender=gender, format=format, quality=quality, cache=cache)
+        else:
+            chunks = generate_stream(text, speaker, server, port, key, uuid, lang, emotion, gender, ipv4, format, quality, cache=cache, catalogue=catalogue)
+        if format == 'wav':
+            file = WavWriter(file, SAMPLE_RATES[quality])
+        for chunk in chunks:
+            file.write(chunk.audio)
+        file.close()
+    except SynthesisError as e:
+        logger.info(str(e))
+        sys.exit(2)
+    except TtsError as e:
+        logger.info("%s Exiting." % (e,))
+        sys.exit(1)
     logger.info("Request complete")
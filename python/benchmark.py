@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks of ASR and TTS client hot paths against the local mock server.
+
+Every benchmark is run --warmup times unrecorded and then --repeat times, each metric
+is reported as the median of the runs along with their minimum and maximum.
+Results are printed (or saved) as JSON. Pass a previous result with --compare
+to fail when some median regressed:
+
+    ./benchmark.py --output 0.5.0.json
+    ./benchmark.py --compare 0.5.0.json --tolerance 0.2 --repeat 9
+"""
+
+from __future__ import absolute_import, division
+import json
+import platform
+import socket
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+
+import click
+
+from asrclient import client, ttsclient
+from asrclient.mockserver import MockServer
+from asrclient.transport import Transport
+from asrclient.voiceproxy_pb2 import AddData
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def bench_frames(messages, chunk_size):
+    """Transport frame encode + decode throughput over a socket pair."""
+    a, b = socket.socketpair()
+    sender, receiver = Transport.fromSocket(a), Transport.fromSocket(b)
+    message = AddData(lastChunk=False, audioData=b'\x00' * chunk_size)
+
+    def send():
+        for _ in range(messages):
+            sender.sendProtobuf(message)
+
+    start = time.time()
+    thread = threading.Thread(target=send)
+    thread.start()
+    for _ in range(messages):
+        receiver.recvProtobuf(AddData)
+    thread.join()
+    elapsed = time.time() - start
+    sender.close()
+    receiver.close()
+    return {
+        'messages_per_sec': messages / elapsed,
+        'megabytes_per_sec': messages * chunk_size / elapsed / 1024 / 1024,
+    }
+
+
+class TimedConnection(client.ServerConnection):
+    """Remembers when every chunk was sent."""
+
+    def __init__(self, *args, **kwargs):
+        self.sent_at = []
+        client.ServerConnection.__init__(self, *args, **kwargs)
+
+    def add_data(self, chunk, last=False):
+        # before sending, the answer may come before add_data returns
+        self.sent_at.append(time.time())
+        client.ServerConnection.add_data(self, chunk, last=last)
+
+
+def connect(server, connection_type=client.ServerConnection):
+    return connection_type(server.host, server.port, client.DEFAULT_KEY_VALUE, 'benchmark', 'dictation', client.DEFAULT_MODEL_VALUE,
+                           client.DEFAULT_LANG_VALUE, client.DEFAULT_FORMAT_VALUE, client.DEFAULT_UUID_VALUE,
+                           client.DEFAULT_INTER_UTT_SILENCE, client.DEFAULT_CMN_LATENCY, "")
+
+
+def bench_recognize(chunks, chunk_size, latency):
+    """End-to-end recognize(): time from sending a chunk to the response answering it."""
+    latencies = []
+    with MockServer(port=0, latency=latency) as server:
+        connection = connect(server, TimedConnection)
+        answered = [0]
+
+        def on_response(response, correction=0):
+            answered[0] += response.messagesCount
+            latencies.append(time.time() - connection.sent_at[answered[0] - 1])
+
+        start = time.time()
+        client.recognize([b'\x00' * chunk_size] * chunks, advanced_callback=on_response, connection=connection)
+        elapsed = time.time() - start
+    return {
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p90_ms': percentile(latencies, 90) * 1000,
+        'latency_p99_ms': percentile(latencies, 99) * 1000,
+        'chunks_per_sec': chunks / elapsed,
+    }
+
+
+class Sink(object):
+    def write(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+def bench_tts(sessions, concurrency, text):
+    """ttsclient.generate() sessions per second and requests per second over pooled TtsSessions."""
+    def run(generate):
+        start = time.time()
+        threads = [threading.Thread(target=lambda: [generate() for _ in range(sessions // concurrency)]) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (sessions // concurrency) * concurrency / (time.time() - start)
+
+    with MockServer(port=0) as server:
+        results = {
+            'sessions_per_sec': run(lambda: ttsclient.generate(Sink(), text, 'jane', server=server.host, port=server.port, format='pcm')),
+        }
+        pool = ttsclient.TtsSessionPool(concurrency, server=server.host, port=server.port)
+        results['pooled_requests_per_sec'] = run(lambda: [chunk for chunk in pool.generate(text, 'jane', format='pcm')])
+        pool.close()
+    return results
+
+
+def bench_memory(sessions, chunk_size):
+    """Memory held by every recognize() session while all of them are in flight, mock server side included."""
+    with MockServer(port=0) as server:
+        started = threading.Semaphore(0)
+        release = threading.Event()
+
+        def chunks():
+            yield b'\x00' * chunk_size
+            started.release()
+            release.wait()
+            yield b'\x00' * chunk_size
+
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        threads = [threading.Thread(target=client.recognize, args=(chunks(),), kwargs={'server': server.host, 'port': server.port})
+                   for _ in range(sessions)]
+        for thread in threads:
+            thread.start()
+        for _ in range(sessions):
+            started.acquire()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        release.set()
+        for thread in threads:
+            thread.join()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return {
+        'session_bytes': allocated / sessions,
+    }
+
+
+BENCHMARKS = ['frames', 'recognize', 'tts', 'memory']
+
+
+def repeat(run, times, warmup):
+    """Runs a benchmark warmup + times times, returns the median, minimum and maximum of every metric over the last times runs."""
+    for _ in range(warmup):
+        run()
+    runs = [run() for _ in range(times)]
+    return dict((metric, {
+        'median': statistics.median(values),
+        'min': min(values),
+        'max': max(values),
+    }) for metric, values in ((metric, [result[metric] for result in runs]) for metric in runs[0]))
+
+
+def median(value):
+    # results saved before repeated runs hold plain numbers
+    return value['median'] if isinstance(value, dict) else value
+
+
+def compare(results, baseline, tolerance):
+    """Returns descriptions of metrics whose median got worse than baseline by more than tolerance."""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            old = baseline.get('results', {}).get(name, {}).get(metric)
+            if not old:
+                continue
+            value, old = median(value), median(old)
+            if not old:
+                continue
+            # throughput is better when higher, latency and memory when lower
+            change = (old - value) / old if metric.endswith('_per_sec') else (value - old) / old
+            if change > tolerance:
+                regressions.append('{0}.{1}: {2:.2f} -> {3:.2f} ({4:.0%} worse)'.format(name, metric, old, value, change))
+    return regressions
+
+
+@click.command()
+@click.option('--only',
+              multiple=True,
+              type=click.Choice(BENCHMARKS),
+              help='Run only this benchmark, may be repeated. Default is to run all of them.')
+@click.option('--chunk-size',
+              default=client.DEFAULT_CHUNK_SIZE_VALUE,
+              help='Audio chunk size. Default is {0}.'.format(client.DEFAULT_CHUNK_SIZE_VALUE))
+@click.option('--messages',
+              default=20000,
+              help='Frames to encode and decode. Default is 20000.')
+@click.option('--chunks',
+              default=500,
+              help='Chunks to recognize. Default is 500.')
+@click.option('--latency',
+              default=0.0,
+              help='Mock server latency in seconds. Default is 0.')
+@click.option('--sessions',
+              default=200,
+              help='TTS sessions to open and ASR sessions to hold at once for the memory benchmark. Default is 200.')
+@click.option('--concurrency',
+              default=4,
+              help='Parallel TTS sessions. Default is 4.')
+@click.option('--output',
+              type=click.File('w'),
+              default='-',
+              help='Write JSON results here. Default is stdout.')
+@click.option('--compare', 'baseline',
+              type=click.File('r'),
+              default=None,
+              help='JSON results of a previous run, exit with an error if some metric regressed.')
+@click.option('--tolerance',
+              default=0.1,
+              help='Allowed regression, 0.1 means 10%. Default is 0.1.')
+@click.option('--repeat', 'times',
+              default=5,
+              type=click.IntRange(1),
+              help='Recorded runs of every benchmark. Default is 5.')
+@click.option('--warmup',
+              default=1,
+              type=click.IntRange(0),
+              help='Unrecorded runs of every benchmark before the recorded ones. Default is 1.')
+def main(only, chunk_size, messages, chunks, latency, sessions, concurrency, output, baseline, tolerance, times, warmup):
+    runs = {
+        'frames': lambda: bench_frames(messages, chunk_size),
+        'recognize': lambda: bench_recognize(chunks, chunk_size, latency),
+        'tts': lambda: bench_tts(sessions, concurrency, u'Съешь же ещё этих мягких французских булок, да выпей чаю.'),
+        'memory': lambda: bench_memory(sessions, chunk_size),
+    }
+    results = {}
+    for name in only or BENCHMARKS:
+        results[name] = repeat(runs[name], times, warmup)
+
+    json.dump({
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': times,
+        'warmup': warmup,
+        'results': results,
+    }, output, indent=2, sort_keys=True)
+    output.write('\n')
+
+    if baseline is not None:
+        regressions = compare(results, json.load(baseline), tolerance)
+        for regression in regressions:
+            click.echo('Regression: ' + regression, err=True)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+        main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import importlib.util
+import os
+
+from click.testing import CliRunner
+
+from asrclient.mockserver import MockServer
+
+CLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'asrclient-cli.py')
+
+
+def load_cli():
+    spec = importlib.util.spec_from_file_location('asrclient_cli', CLI_PATH)
+    cli = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cli)
+    return cli
+
+
+def test_transcript_path_keeps_subdirectories(tmp_path):
+    cli = load_cli()
+    first, second = str(tmp_path / 'x' / 'call.raw'), str(tmp_path / 'y' / 'call.raw')
+    root = cli.input_root([first, second])
+    assert root == str(tmp_path)
+    assert cli.transcript_path(first, 'out', root) == os.path.join('out', 'x', 'call.raw.txt')
+    assert cli.transcript_path(second, 'out', root) == os.path.join('out', 'y', 'call.raw.txt')
+    assert cli.transcript_path(first, None, root) == first + '.txt'
+
+
+def test_batch_files_with_the_same_name(tmp_path):
+    cli = load_cli()
+    inputs = tmp_path / 'records'
+    for directory in ('x', 'y'):
+        (inputs / directory).mkdir(parents=True)
+        (inputs / directory / 'call.raw').write_bytes(b'\0' * 32000)
+    output = tmp_path / 'out'
+
+    with MockServer(port=0) as server:
+        args = ['--silent', '--batch', '-s', server.host, '-p', str(server.port), '--output-dir', str(output), str(inputs)]
+        result = CliRunner().invoke(cli.main, args)
+        assert result.exit_code == 0, result.output
+        for directory in ('x', 'y'):
+            transcript = output / directory / 'call.raw.txt'
+            assert transcript.read_bytes().decode('utf-8').strip() == server.text
+
+        result = CliRunner().invoke(cli.main, args + ['--resume'])
+        assert result.exit_code == 0, result.output
+        assert 'Nothing to recognize.' in result.output
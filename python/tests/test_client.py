@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import time
+
+from asrclient import client
+from asrclient.mockserver import MockServer
+
+
+def test_recognize_many_empty_batch():
+    stats = client.recognize_many([], server='127.0.0.1', port=1)
+    assert stats['sources'] == 0
+    assert stats['failed'] == 0
+    assert stats['errors'] == []
+    assert stats['bytes'] == 0
+
+
+def test_recognize_many():
+    done = []
+    with MockServer(port=0) as server:
+        stats = client.recognize_many([[b'\0' * 3200] * 3] * 2, server=server.host, port=server.port,
+                                      done_callback=lambda index, error: done.append((index, error)))
+    assert stats['sources'] == 2
+    assert stats['failed'] == 0
+    assert sorted(done) == [(0, None), (1, None)]
+
+
+def test_partial_interval_delivers_the_newest_skipped_partial():
+    partials = []
+    resumed = []
+
+    def chunks():
+        for _ in range(5):
+            yield b'\0' * 3200
+        # the burst of partials is over well before the interval ends
+        time.sleep(1.0)
+        resumed.append(time.time())
+        yield b'\0' * 3200
+
+    def on_response(response, correction=None):
+        if not response.endOfUtt:
+            partials.append((time.time(), len(response.recognition[0].words)))
+
+    text = u' '.join(u'w{0}'.format(i) for i in range(100))
+    with MockServer(port=0, utterance_chunks=100, text=text) as server:
+        client.recognize(chunks(), advanced_callback=on_response, server=server.host, port=server.port, partial_interval=500)
+
+    # the first partial goes at once, the newest of the rest when the interval is over, before more audio is sent
+    assert [words for _, words in partials[:2]] == [1, 5]
+    assert partials[1][0] < resumed[0]
+
+
+def test_resume_after_the_last_chunk_was_sent():
+    utterances = []
+    # messages: connection request, 3 chunks ending an utterance, the 4th chunk, the last chunk marker which is dropped
+    with MockServer(port=0, utterance_chunks=3, fault_every=6) as server:
+        client.recognize([b'\0' * 3200] * 4, callback=lambda utterance, start, end, data: utterances.append((round(start, 3), round(end, 3), len(data))),
+                         server=server.host, port=server.port, reconnect_delay=0)
+        assert server.faults == 1
+    assert utterances == [(0.0, 0.3, 3), (0.3, 0.4, 2)]
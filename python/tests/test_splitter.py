@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import types
+
+from asrclient import client
+from asrclient.mockserver import MockServer
+from asrclient.splitter import UtteranceSplitter
+
+
+def test_splitter_after_reconnect(tmp_path):
+    splitter = UtteranceSplitter(str(tmp_path))
+    module = types.ModuleType('splitter_callback_module')
+    module.advanced_utterance_callback = lambda response, data_chunks: splitter.add_utterance(response, data_chunks, correction=module.correction_delta)
+    sys.modules[module.__name__] = module
+    try:
+        # utterances of 5 chunks, the connection is dropped in the third one
+        with MockServer(port=0, utterance_chunks=5, fault_every=15) as server:
+            client.recognize([b'\1\0' * 1600] * 20, callback_module=module.__name__, server=server.host, port=server.port, reconnect_delay=0)
+            assert server.faults > 0
+    finally:
+        del sys.modules[module.__name__]
+    splitter.close()
+
+    names = sorted(os.listdir(str(tmp_path)))
+    assert names == ['0.txt', '0.wav', '1.txt', '1.wav', '2.txt', '2.wav', '3.txt', '3.wav']
+    for index in range(4):
+        # half a second of 16 kHz 16 bit audio each, wav header included
+        assert os.path.getsize(str(tmp_path / '{0}.wav'.format(index))) == 16000 + 44
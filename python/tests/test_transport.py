@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import socket
+import ssl
+import threading
+import time
+
+import pytest
+
+from asrclient import transport
+from asrclient.transport import Transport, TransportError
+
+
+def stalling_server(response, hold=5.0):
+    """Listens on a free port, answers the first request with response and keeps the connection silent."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        connection, _ = listener.accept()
+        connection.recv(4096)
+        connection.sendall(response)
+        time.sleep(hold)
+        connection.close()
+        listener.close()
+
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return listener.getsockname()[1]
+
+
+def test_upgrade_times_out_on_partial_headers():
+    port = stalling_server(b'HTTP/1.1 101 Switching')
+    t = Transport('127.0.0.1', port, timeout=None, verbose=False, attempts=1)
+    start = time.time()
+    with pytest.raises(TransportError):
+        t.upgrade('GET / HTTP/1.1\r\n\r\n', timeout=0.5)
+    assert time.time() - start < 2.0
+    t.close()
+
+
+def test_upgrade_keeps_what_follows_the_headers():
+    port = stalling_server(b'HTTP/1.1 101 Switching Protocols\r\n\r\n3\r\nabc')
+    t = Transport('127.0.0.1', port, timeout=None, verbose=False, attempts=1)
+    assert t.upgrade('GET / HTTP/1.1\r\n\r\n', timeout=1.0).startswith(b'HTTP/1.1 101')
+    assert t.recvMessage() == b'abc'
+    t.close()
+
+
+def closed_port():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+def test_retries_back_off_from_backoff(monkeypatch):
+    limits = []
+    monkeypatch.setattr(transport.random, 'uniform', lambda low, high: limits.append(high) or 0)
+    with pytest.raises(socket.error):
+        Transport('127.0.0.1', closed_port(), verbose=False, attempts=4, backoff=0.5, max_backoff=1.5)
+    assert limits == [0.5, 1.0, 1.5, 1.5]
+
+
+def test_certificate_errors_are_not_retried(monkeypatch):
+    tries = []
+
+    def wrapSsl(self, sock, context):
+        tries.append(sock)
+        sock.close()
+        raise transport.CERTIFICATE_ERRORS[0]('certificate verify failed')
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(5)
+    monkeypatch.setattr(Transport, 'wrapSsl', wrapSsl)
+    with pytest.raises(ssl.CertificateError):
+        Transport('127.0.0.1', listener.getsockname()[1], verbose=False, enable_ssl=True, attempts=3, backoff=0)
+    listener.close()
+    assert len(tries) == 1
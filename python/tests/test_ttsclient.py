@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+from asrclient import ttsclient
+from asrclient.mockserver import MockServer
+
+
+def test_pool_waiters_wake_up_when_opening_fails():
+    errors = []
+
+    def acquire(pool):
+        try:
+            pool.acquire()
+        except ttsclient.TtsError as e:
+            errors.append(e)
+
+    with MockServer(port=0, key='right', latency=0.2) as server:
+        pool = ttsclient.TtsSessionPool(1, server=server.host, port=server.port, key='wrong')
+        threads = [threading.Thread(target=acquire, args=(pool,)) for _ in range(2)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert not any(thread.is_alive() for thread in threads)
+    assert len(errors) == 2
+
+
+def test_pool_reuses_released_sessions():
+    with MockServer(port=0) as server:
+        pool = ttsclient.TtsSessionPool(1, server=server.host, port=server.port)
+        for _ in range(3):
+            assert list(pool.generate(u'привет', 'jane', format='pcm'))
+        assert pool.opened == 1
+        pool.close()
+    assert server.sessions == 1
+
+
+def test_pooled_requests_are_not_delayed_by_nagle():
+    with MockServer(port=0) as server:
+        pool = ttsclient.TtsSessionPool(1, server=server.host, port=server.port)
+        list(pool.generate(u'привет', 'jane', format='pcm'))
+        times = []
+        for _ in range(10):
+            start = time.time()
+            list(pool.generate(u'привет мир', 'jane', format='pcm'))
+            times.append(time.time() - start)
+        pool.close()
+    # a delayed ACK stall is about 40 ms
+    assert sorted(times)[len(times) // 2] < 0.02
@@ -7,6 +7,7 @@ import click
 import sys
 
 import asrclient.ttsclient as client
+from asrclient.ttscache import TtsCache
 
 
 @click.command()
@@ -54,15 +55,42 @@ import asrclient.ttsclient as client
 @click.option('--quality',
               default=client.DEFAULT_QUALITY_VALUE,
               help='Quality output audio file. ultra | high | low. Default is {0}.'.format(client.DEFAULT_QUALITY_VALUE))
+@click.option('--split',
+              is_flag=True,
+              help='Split long text at sentence boundaries and synthesize the pieces over several connections at once.')
+@click.option('--connections',
+              default=client.DEFAULT_POOL_SIZE,
+              help='Connections to use with --split. Default is {0}.'.format(client.DEFAULT_POOL_SIZE))
+@click.option('--cache-dir',
+              type=click.Path(file_okay=False),
+              default=None,
+              help='Keep synthesized audio in this directory and reuse it for the same requests.')
+@click.option('--cache-size',
+              default=512,
+              help='Cache directory size limit in megabytes. Default is 512.')
+@click.option('--cache-ttl',
+              default=None,
+              type=int,
+              help='Synthesize again audio cached more than that many seconds ago. Default is to keep it until evicted.')
+@click.option('--voices-file',
+              type=click.Path(dir_okay=False),
+              default=None,
+              help='Keep the speakers list in this file, ask the server again only when it\'s older than --voices-ttl.')
+@click.option('--voices-ttl',
+              default=client.DEFAULT_VOICES_TTL,
+              help='Speakers list lifetime in seconds. Default is {0}.'.format(client.DEFAULT_VOICES_TTL))
 @click.argument('file',
               required=False,
               type=click.File('wb'))
 @click.argument('texts',
                 nargs=-1)
 
-def main(silent, speaker, texts, textfile=None, list_speakers=False, **kwars):
+def main(silent, speaker, texts, textfile=None, list_speakers=False, split=False, connections=client.DEFAULT_POOL_SIZE, cache_dir=None, cache_size=512, cache_ttl=None, voices_file=None, voices_ttl=client.DEFAULT_VOICES_TTL, **kwars):
     if not silent:
         logging.basicConfig(level=logging.INFO)
+    if voices_file:
+        kwars['catalogue'] = client.VoiceCatalogue(kwars['server'], kwars['port'], kwars['key'], kwars['uuid'], kwars['ipv4'],
+                                                   path=voices_file, ttl=voices_ttl)
     if list_speakers:
         client.list_speakers(**kwars)
         sys.exit(0)
@@ -71,7 +99,9 @@ def main(silent, speaker, texts, textfile=None, list_speakers=False, **kwars):
         sys.exit(1)
     if textfile:
         texts = map(str.strip, textfile.readlines())
-    client.generate(text=" ".join(texts).decode('utf8'), speaker=speaker, **kwars)
+    if cache_dir:
+        kwars['cache'] = TtsCache(cache_dir, max_bytes=cache_size * 1024 * 1024, ttl=cache_ttl)
+    client.generate(text=" ".join(texts).decode('utf8'), speaker=speaker, split=split, concurrency=connections, **kwars)
 
 if __name__ == "__main__":
         main()